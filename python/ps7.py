@@ -6,7 +6,6 @@
 
 import numpy
 import random
-import pylab
 
 ''' 
 Begin helper code
@@ -188,6 +187,8 @@ def simulationWithoutDrug(numTrials = 20, numTimeSteps = 500):
     Instantiates a patient, runs a simulation for 300 timesteps, and plots the
     total virus population as a function of time.
     """
+    import pylab
+
     random.seed()
 
     # Virus Characteristics.
@@ -219,4 +220,5 @@ def simulationWithoutDrug(numTrials = 20, numTimeSteps = 500):
     pylab.errorbar(time[selectedTime], meanData[selectedTime], stdData95_CI[selectedTime], fmt = 'o')    
     pylab.show()
     
-simulationWithoutDrug()
+if __name__ == '__main__':
+    simulationWithoutDrug()
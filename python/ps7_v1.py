@@ -6,7 +6,6 @@
 
 import numpy
 import random
-import pylab
 
 ''' 
 Begin helper code
@@ -44,14 +43,16 @@ class SimpleVirus(object):
         self.maxBirthProb = maxBirthProb
         self.clearProb = clearProb
 
-    def doesClear(self):
+    def doesClear(self, rng=random):
 
         """ Stochastically determines whether this virus particle is cleared from the
         patient's body at a time step. 
+        rng: random number generator with a random() method (defaults to the
+        random module)
         returns: True with probability self.clearProb and otherwise returns
         False.
         """        
-        return random.random() < self.clearProb
+        return rng.random() < self.clearProb
 
     
     def reproduce(self, popDensity):
@@ -73,16 +74,38 @@ class SimpleVirus(object):
         offspring of this virus particle. The child should have the same
         maxBirthProb and clearProb values as this virus. Raises a
         NoChildException if this virus particle does not reproduce.               
+
+        Kept for compatibility, patients use offspringOf() instead.
         """
 
-        # Does the virus reproduce?        
-        maxReproduceProb = self.maxBirthProb * (1 - popDensity)
-        
-        if random.random() < maxReproduceProb:
-            childOfVirus = SimpleVirus(self.maxBirthProb, self.clearProb)
-            return childOfVirus
-        
-        else: raise NoChildException('Child not created!')
+        offspring = offspringOf([self], popDensity)
+        if not offspring: raise NoChildException('Child not created!')
+        return offspring[0]
+
+def offspringOf(viruses, popDensity, rng=random):
+
+    """
+    Batch version of SimpleVirus.reproduce(): stochastically determines which
+    virus particles of a population reproduce at a time step, without
+    raising NoChildException for the (many) particles that do not.
+
+    viruses: the virus population (a list of SimpleVirus instances)
+
+    popDensity: the population density (a float)
+
+    rng: random number generator with a random() method (defaults to the
+    random module)
+
+    returns: the offspring of the population (a list of new SimpleVirus
+    instances with the maxBirthProb and clearProb values of their parents)
+    """
+
+    offspring = []
+    for virus in viruses:
+        # Does the virus reproduce?
+        if rng.random() < virus.maxBirthProb * (1 - popDensity):
+            offspring.append(SimpleVirus(virus.maxBirthProb, virus.clearProb))
+    return offspring
 
 class SimplePatient(object):
     
@@ -90,8 +113,11 @@ class SimplePatient(object):
     Representation of a simplified patient. The patient does not take any drugs
     and his/her virus populations have no drug resistance.
     """
+
+    # A virussim.profiling.UpdateProfile to instrument update() with, or None
+    profile = None
     
-    def __init__(self, viruses, maxPop):
+    def __init__(self, viruses, maxPop, rng=None):
         
         """
         Initialization function, saves the viruses and maxPop parameters as
@@ -101,6 +127,9 @@ class SimplePatient(object):
         SimpleVirus instances)
 
         maxPop: the  maximum virus population for this patient (an integer)
+
+        rng: random number generator with a random() method, e.g. a
+        random.Random instance (defaults to the random module)
         """
 
         errorMsg1 = 'viruses must be a list containing SimpleVirus objects'
@@ -112,6 +141,8 @@ class SimplePatient(object):
         if type(maxPop)!= int: raise ValueError(errorMsg2)
         self.maxPop = maxPop
 
+        self.rng = random if rng is None else rng
+
     def getTotalPop(self):
         
         """
@@ -137,16 +168,23 @@ class SimplePatient(object):
         returns: The total virus population at the end of the update (an
         integer)
         """
+
+        profile = self.profile
+        if profile is not None:
+            profile.startStep(len(self.viruses))
+            profile.rngDraws += len(self.viruses)
         
         # Determine number of viruses to be cleaned, "stochastically".
         numRemoveVirus = 0
         for virus in self.viruses:
-            if virus.doesClear():
+            if virus.doesClear(self.rng):
                 numRemoveVirus += 1
 
         # Remove numRemoveVirus from the patient's body.
         for virusNum in range(numRemoveVirus):
             self.viruses.pop()
+        if profile is not None:
+            profile.lap('clearance')
 
         # Calculate population density. TO DO check (keep self!)
         popDensity = self.getTotalPop()/float(self.maxPop)
@@ -154,35 +192,185 @@ class SimplePatient(object):
         if popDensity >= 1:
             print 'virus population reached maximum!'
             popDensity = 1       
+        if profile is not None:
+            profile.lap('density')
+            profile.rngDraws += len(self.viruses)
 
         # Reproduce at a single time step.
-        offspringViruses = []
-        for virus in self.viruses:
-            try:
-                offspringViruses.append(virus.reproduce(popDensity))
-            except NoChildException: pass
-            
-        self.viruses = self.viruses + offspringViruses
+        offspring = offspringOf(self.viruses, popDensity, self.rng)
+        self.viruses = self.viruses + offspring
+        if profile is not None:
+            profile.objectsAllocated += len(offspring)
+            profile.lap('reproduction')
         
         return self.getTotalPop()
 
+class SimpleVirusPopulation(object):
+
+    """
+    Structure-of-arrays store for a population of simple virus particles.
+    Holds the maxBirthProb and clearProb of every particle in contiguous
+    numpy arrays so that clearance and reproduction can be drawn for the
+    whole population at once instead of calling doesClear()/reproduce()
+    on one SimpleVirus object at a time.
+    """
+
+    def __init__(self, maxBirthProbs, clearProbs):
+
+        """
+        Initialize a SimpleVirusPopulation instance.
+
+        maxBirthProbs: per-particle maximum reproduction probabilities (a
+        sequence of floats between 0-1)
+
+        clearProbs: per-particle clearance probabilities (a sequence of floats
+        between 0-1, the same length as maxBirthProbs)
+        """
+
+        self.maxBirthProbs = numpy.asarray(maxBirthProbs, dtype=float)
+        self.clearProbs = numpy.asarray(clearProbs, dtype=float)
+
+        if self.maxBirthProbs.shape != self.clearProbs.shape:
+            raise ValueError('maxBirthProbs and clearProbs must have the same length!')
+
+    def __len__(self):
+        return len(self.maxBirthProbs)
+
+    def update(self, maxPop, rng=numpy.random, profile=None):
+
+        """
+        Advance the population by a single time step, in the same order as
+        SimplePatient.update(): clearance, population density, reproduction.
+
+        maxPop: the maximum virus population of the patient (an integer)
+
+        rng: random number generator with the numpy.random interface, e.g. a
+        numpy.random.RandomState (defaults to the numpy.random module)
+
+        profile: a virussim.profiling.UpdateProfile the phases are timed
+        and counted in, or None
+
+        returns: The total virus population at the end of the update (an
+        integer)
+        """
+
+        if profile is not None:
+            profile.startStep(len(self))
+            profile.rngDraws += len(self)
+
+        # Clearance as one Bernoulli draw per particle.
+        survive = rng.random_sample(len(self)) >= self.clearProbs
+        self.maxBirthProbs = self.maxBirthProbs[survive]
+        self.clearProbs = self.clearProbs[survive]
+        if profile is not None:
+            profile.lap('clearance')
+
+        popDensity = len(self)/float(maxPop)
+
+        if popDensity >= 1:
+            print 'virus population reached maximum!'
+            popDensity = 1
+        if profile is not None:
+            profile.lap('density')
+            profile.rngDraws += len(self)
+
+        # Reproduction as one Bernoulli draw per surviving particle; the
+        # offspring copy the parameters of their parents.
+        reproduceProbs = self.maxBirthProbs * (1 - popDensity)
+        born = rng.random_sample(len(self)) < reproduceProbs
+        self.maxBirthProbs = numpy.concatenate((self.maxBirthProbs, self.maxBirthProbs[born]))
+        self.clearProbs = numpy.concatenate((self.clearProbs, self.clearProbs[born]))
+        # Offspring are array entries, not objects, so none are allocated
+        if profile is not None:
+            profile.lap('reproduction')
+
+        return len(self)
+
+class ArraySimplePatient(SimplePatient):
+
+    """
+    SimplePatient whose virus population is kept in a SimpleVirusPopulation
+    rather than a list of SimpleVirus instances. getTotalPop() and update()
+    behave exactly as in SimplePatient.
+    """
+
+    def __init__(self, viruses, maxPop, rng=None):
+
+        """
+        Initialization function, saves the viruses and maxPop parameters as
+        attributes.
+
+        viruses: the virus population (a SimpleVirusPopulation, or a list of
+        SimpleVirus instances which is converted into one)
+
+        maxPop: the  maximum virus population for this patient (an integer)
+
+        rng: random number generator with the numpy.random interface
+        (defaults to the numpy.random module)
+        """
+
+        errorMsg1 = 'viruses must be a SimpleVirusPopulation or a list containing SimpleVirus objects'
+        errorMsg2 = 'maxPop, or maximum virus population must be an integer!'
+
+        if type(viruses) == list:
+            viruses = SimpleVirusPopulation([virus.maxBirthProb for virus in viruses],
+                                            [virus.clearProb for virus in viruses])
+        if not isinstance(viruses, SimpleVirusPopulation): raise ValueError(errorMsg1)
+        self.viruses = viruses
+
+        if type(maxPop)!= int: raise ValueError(errorMsg2)
+        self.maxPop = maxPop
+
+        self.rng = numpy.random if rng is None else rng
+
+    def getTotalPop(self):
+
+        """
+        Gets the current total virus population.
+        returns: The total virus population (an integer)
+        """
+
+        return len(self.viruses)
+
+    def update(self):
+
+        """
+        Update the state of the virus population in this patient for a single
+        time step, drawing clearance and reproduction for all particles at
+        once.
+
+        returns: The total virus population at the end of the update (an
+        integer)
+        """
+
+        return self.viruses.update(self.maxPop, self.rng, self.profile)
+
 def virusCollection(numViruses, maxBirthProb, clearProb):
     viruses = []
     for virusNum in range(numViruses):
         viruses.append(SimpleVirus(maxBirthProb, clearProb))
     return viruses       
 
+def virusPopulation(numViruses, maxBirthProb, clearProb):
+    return SimpleVirusPopulation(numpy.repeat(float(maxBirthProb), numViruses),
+                                 numpy.repeat(float(clearProb), numViruses))
+
 #
 # PROBLEM 2
 #
-def simulationWithoutDrug(numTrials = 100, numTimeSteps = 500):
+def simulationWithoutDrug(numTrials = 100, numTimeSteps = 500, vectorized = False):
 
     """
     Run the simulation and plot the graph for problem 2 (no drugs are used,
     viruses do not have any drug resistance).
     Instantiates a patient, runs a simulation for 300 timesteps, and plots the
     total virus population as a function of time.
+
+    vectorized: if True, patients are ArraySimplePatient instances backed by
+    a SimpleVirusPopulation instead of lists of SimpleVirus objects.
     """
+    import pylab
+
     random.seed()
 
     # Virus Characteristics.
@@ -195,8 +383,12 @@ def simulationWithoutDrug(numTrials = 100, numTimeSteps = 500):
     for trial in range(numTrials):        
 
         # Model a random patient with the given virus charateristics.        
-        viruses = virusCollection(numViruses, maxBirthProb, clearProb)
-        randPatientX = SimplePatient(viruses, maxPop)
+        if vectorized:
+            viruses = virusPopulation(numViruses, maxBirthProb, clearProb)
+            randPatientX = ArraySimplePatient(viruses, maxPop)
+        else:
+            viruses = virusCollection(numViruses, maxBirthProb, clearProb)
+            randPatientX = SimplePatient(viruses, maxPop)
 
         # Simulate the time-steps.
         dataMatrix[trial][0] = numViruses
@@ -214,6 +406,7 @@ def simulationWithoutDrug(numTrials = 100, numTimeSteps = 500):
     pylab.errorbar(time[selectedTime], meanData[selectedTime], stdData95_CI[selectedTime], fmt = 'o')    
     pylab.show()
     
-simulationWithoutDrug()
+if __name__ == '__main__':
+    simulationWithoutDrug()
 
 # End: August 4, 2016; 9:51 am
@@ -1,6 +1,5 @@
 import numpy
 import random
-import pylab
 
 ''' 
 Begin helper code
@@ -288,6 +287,7 @@ def simulationWithoutDrug(numTrials = 100, numTimeSteps = 500):
     Instantiates a patient, runs a simulation for 300 timesteps, and plots the
     total virus population as a function of time.
     """
+    import pylab
     random.seed()
 
     # Virus Characteristics.
@@ -319,6 +319,7 @@ def simulationWithoutDrug(numTrials = 100, numTimeSteps = 500):
     pylab.errorbar(time[selectedTime], meanData[selectedTime], stdData95_CI[selectedTime], fmt = 'o')    
     pylab.show()
     
-simulationWithoutDrug()
+if __name__ == '__main__':
+    simulationWithoutDrug()
 
 # End: August 4, 2016; 9:51 am
@@ -1,6 +1,5 @@
 import numpy 
 import random
-import pylab
 import collections
 
 from ps7_v1 import *
@@ -237,6 +236,7 @@ def simulationWithOneDrug(numTrials = 100,numTimeStepsAfterDrug = 150):
     followed by the addition of the drug, 
     guttagonol, followed by another 150 time steps.
     '''
+    import pylab
 
     # To get same random results
     random.seed(0)
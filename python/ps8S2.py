@@ -1,10 +1,14 @@
 import numpy
 import random
-import pylab
 import collections
-import matplotlib.mlab as mlab
+import copy
+import time
 
 from ps7_v1 import *
+from virussim.model import DRUG_REGISTRY, MUTATION_KERNEL_DRUGS, DrugRegistry, resistantPatient, \
+    simulationParameters
+from virussim.trials import BATCHED_BLOCK_TRIALS, cacheParameters, iterateTrajectories, recordSchedule, \
+    simulateForkedTrajectories, simulateTrajectories
 
 class ResistantVirus(SimpleVirus):
     """
@@ -32,6 +36,39 @@ class ResistantVirus(SimpleVirus):
         self.resistances = resistances
         self.mutProb = mutProb
 
+    def _getResistances(self):
+        return dict((drug, bool(self.genotype >> DRUG_REGISTRY.bits[drug] & 1))
+                    for drug in DRUG_REGISTRY.names(self.traitMask))
+
+    def _setResistances(self, resistances):
+        # traitMask: the drugs this particle carries a resistance trait for.
+        # genotype: the subset of those drugs it is resistant to.
+        self.traitMask = DRUG_REGISTRY.mask(resistances)
+        self.genotype = DRUG_REGISTRY.mask([drug for drug in resistances if resistances[drug]])
+
+    # The resistances dictionary is kept as a view of the genotype bitmask.
+    resistances = property(_getResistances, _setResistances)
+
+    def resistanceMask(self):
+        """
+        returns: the bitmask of all drugs this particle resists (an integer).
+        Drugs it carries no trait for count as resisted, like in
+        isResistantTo(), so their bits are set as well and the mask is
+        negative.
+        """
+        return self.genotype | ~self.traitMask
+
+    def resistsAll(self, drugMask):
+        """
+        Checks resistance against several drugs at once.
+
+        drugMask: bitmask of drugs from DRUG_REGISTRY (an integer)
+
+        returns: True if this virus instance is resistant to every drug in
+        drugMask, False otherwise.
+        """
+        return (self.resistanceMask() & drugMask) == drugMask
+
     def isResistantTo(self, drug):
         """
         Get the state of this virus particle's resistance to a drug. This
@@ -44,9 +81,9 @@ class ResistantVirus(SimpleVirus):
         False otherwise.
         """
         # Assuming the virus is resistant to an unknown drug
-        return self.resistances.get(drug, True)
+        return self.resistsAll(DRUG_REGISTRY.mask([drug]))
 
-    def reproduce(self, popDensity, activeDrugs):
+    def reproduce(self, popDensity, activeDrugs, rng=random):
         """
         Stochastically determines whether this virus particle reproduces at a
         time step. Called by the update() method in the Patient class.
@@ -83,33 +120,139 @@ class ResistantVirus(SimpleVirus):
         activeDrugs: a list of the drug names acting on this virus particle
         (a list of strings).
 
+        rng: random number generator with a random() method (defaults to the
+        random module)
+
         returns: a new instance of the ResistantVirus class representing the
         offspring of this virus particle. The child should have the same
         maxBirthProb and clearProb values as this virus. Raises a
         NoChildException if this virus particle does not reproduce.
         """
 
-        # Checks the resistance of the mother virus to all drugs in activeDrugs list
-        # if mother virus is resistant to all the drugs, reproduction will proceed
-        for drug in activeDrugs:
-            if not self.isResistantTo(drug):
-                raise NoChildException()
-
-        maxReproduceProb = self.maxBirthProb * (1 - popDensity)
-
-        if random.random() < maxReproduceProb:
-            resistance_trait = {}
-            # Calculate the transfer of resistances property to child virus
-            for drug in self.resistances.keys():
-                if random.random() <= (1 - self.mutProb):
-                    resistance_trait[drug] = self.resistances[drug]
-                else:
-                    resistance_trait[drug] = not self.resistances[drug]
-
-            childOfVirus = ResistantVirus(self.maxBirthProb, self.clearProb, resistance_trait, self.mutProb)
-            return childOfVirus
-        else:
+        return self.reproduceMasked(popDensity, DRUG_REGISTRY.mask(activeDrugs), rng)
+
+    def reproduceMasked(self, popDensity, activeMask, rng=random):
+        """
+        Same as reproduce(), with the active drugs given as a DRUG_REGISTRY
+        bitmask (an integer) instead of a list of drug names.
+
+        Kept for compatibility, patients use resistantOffspringOf() instead.
+        """
+
+        offspring = resistantOffspringOf([self], popDensity, activeMask, rng)
+        if not offspring:
             raise NoChildException()
+        return offspring[0]
+
+    def makeChild(self, genotype):
+        """
+        returns: a new ResistantVirus with the same parameters and resistance
+        traits as this virus and the given genotype bitmask (an integer).
+        """
+        childOfVirus = ResistantVirus.__new__(ResistantVirus)
+        childOfVirus.maxBirthProb = self.maxBirthProb
+        childOfVirus.clearProb = self.clearProb
+        childOfVirus.mutProb = self.mutProb
+        childOfVirus.traitMask = self.traitMask
+        childOfVirus.genotype = genotype
+        return childOfVirus
+
+def resistantOffspringOf(viruses, popDensity, activeMask, rng=random, profile=None, mutationRng=None):
+    """
+    Batch version of ResistantVirus.reproduce(): stochastically determines
+    which virus particles of a population reproduce at a time step, without
+    raising NoChildException for the particles that do not.
+
+    The parents are chosen first and their children mutated afterwards
+    (see reproducingParents and mutatedOffspringOf).
+
+    viruses: the virus population (a list of ResistantVirus instances)
+
+    popDensity: the population density (a float)
+
+    activeMask: DRUG_REGISTRY bitmask of the drugs acting on the population
+    (an integer)
+
+    rng: random number generator with a random() method (defaults to the
+    random module)
+
+    profile: a virussim.profiling.UpdateProfile whose current lap is
+    timed up to the chosen parents (reproduction) and then the mutated
+    children (mutation), and the random draws are added to, or None
+
+    mutationRng: a numpy.random.RandomState to mutate all children at once
+    with (see virussim.mutation), or None to flip their traits one by one
+    with rng
+
+    returns: the offspring of the population (a list of new ResistantVirus
+    instances, each with the parameters of its parent and every resistance
+    trait flipped with probability mutProb)
+    """
+
+    candidates = [virus for virus in viruses if virus.resistsAll(activeMask)]
+    parents = reproducingParents(candidates, popDensity, rng)
+    if profile is None:
+        return mutatedOffspringOf(parents, rng, mutationRng)
+
+    from virussim.profiling import CountingGenerator
+
+    profile.rngDraws += len(candidates)
+    profile.lap('reproduction')
+    if mutationRng is None:
+        offspring = mutatedOffspringOf(parents, rng)
+        profile.rngDraws += sum(bin(virus.traitMask).count('1') for virus in parents)
+    else:
+        counter = CountingGenerator(mutationRng)
+        offspring = mutatedOffspringOf(parents, rng, counter)
+        profile.rngDraws += counter.draws
+    profile.objectsAllocated += len(offspring)
+    profile.lap('mutation')
+    return offspring
+
+def reproducingParents(viruses, popDensity, rng=random):
+    """
+    returns: the particles of viruses (a list of ResistantVirus instances
+    that may all reproduce) that reproduce at a population density of
+    popDensity, one random() draw each
+    """
+    return [virus for virus in viruses if rng.random() < virus.maxBirthProb * (1 - popDensity)]
+
+def mutatedOffspringOf(parents, rng=random, mutationRng=None):
+    '''
+    Creates the children of the parents (a list of ResistantVirus
+    instances), each resistance trait flipped with probability mutProb.
+    With a mutationRng the trait flips of all children that share
+    resistance traits and mutProb are drawn with one call to
+    virussim.mutation.mutateGenotypes; otherwise every trait of every
+    child draws from rng in turn.
+
+    returns: the offspring, in the order of their parents
+    '''
+    if mutationRng is None:
+        offspring = []
+        for virus in parents:
+            flips = 0
+            traits = virus.traitMask
+            while traits:
+                trait = traits & -traits
+                if rng.random() < virus.mutProb:
+                    flips |= trait
+                traits ^= trait
+            offspring.append(virus.makeChild(virus.genotype ^ flips))
+        return offspring
+
+    from virussim.mutation import mutateGenotypes
+
+    groups = {}
+    for index, virus in enumerate(parents):
+        groups.setdefault((virus.traitMask, virus.mutProb), []).append(index)
+    offspring = [None] * len(parents)
+    for traitMask, mutProb in sorted(groups):
+        indices = groups[(traitMask, mutProb)]
+        genotypes = mutateGenotypes([parents[index].genotype for index in indices], traitMask, mutProb, mutationRng)
+        for index, genotype in zip(indices, genotypes):
+            offspring[index] = parents[index].makeChild(int(genotype))
+    return offspring
 
 class Patient(SimplePatient):
     """
@@ -117,7 +260,11 @@ class Patient(SimplePatient):
     his/her virus population can acquire resistance to the drugs he/she takes.
     """
 
-    def __init__(self, viruses, maxPop):
+    # numpy.random.RandomState the offspring are mutated with in one batch
+    # per step (see resistantOffspringOf), or None to mutate them one by one
+    mutationRng = None
+
+    def __init__(self, viruses, maxPop, rng=None):
         """
         Initialization function, saves the viruses and maxPop parameters as
         attributes. Also initializes the list of drugs being administered
@@ -127,11 +274,20 @@ class Patient(SimplePatient):
         ResistantVirus instances)
 
         maxPop: The  maximum virus population for this patient (an integer)
+
+        rng: random number generator with a random() method, e.g. a
+        random.Random instance (defaults to the random module)
         """
 
         self.viruses = viruses
         self.maxPop = maxPop
+        self.rng = random if rng is None else rng
         self.administeredDrugs = []
+        self.activeMask = 0
+
+        # Number of particles per resistanceMask(), kept up to date by
+        # update() so that getResistPop() never walks the population
+        self.census = collections.Counter(virus.resistanceMask() for virus in viruses)
 
     def addPrescription(self, newDrug):
         """
@@ -144,7 +300,27 @@ class Patient(SimplePatient):
         postcondition: The list of drugs being administered to a patient is updated
         """
 
-        self.administeredDrugs.append(newDrug)
+        if newDrug not in self.administeredDrugs:
+            self.administeredDrugs.append(newDrug)
+            self.activeMask |= DRUG_REGISTRY.mask([newDrug])
+
+    def knownMask(self, drugs):
+        """
+        returns: the DRUG_REGISTRY bitmask of a list of drugs, the mask
+        setActiveMask() takes (e.g. for TreatmentSchedule.compile())
+        """
+        return DRUG_REGISTRY.mask(drugs)
+
+    def setActiveMask(self, activeMask):
+        """
+        Administer exactly the drugs whose DRUG_REGISTRY bits are set in
+        activeMask, e.g. one step of a compiled virussim.schedule
+        TreatmentSchedule, adding and removing prescriptions as needed.
+        """
+        drugs = DRUG_REGISTRY.names(activeMask)
+        self.administeredDrugs = [drug for drug in self.administeredDrugs if drug in drugs] + \
+            [drug for drug in drugs if drug not in self.administeredDrugs]
+        self.activeMask = activeMask
 
     def getPrescriptions(self):
         """
@@ -167,21 +343,35 @@ class Patient(SimplePatient):
         all drugs in the drugResist list.
         """
 
-        # Variable to hold the number of resistant viruses
-        virus_pop = 0
+        if len(drugResist) == 0:
+            return 0
 
-        # Checks each virus in viruses of a patient
-        for virus in self.viruses:
-            drugsResisted = 0
-            for drug in drugResist:
-                if virus.isResistantTo(drug):
-                    drugsResisted += 1
-            # If the drugsResisted equals length of drugResist,
-            # then the virus is resistant to all drugs in drugResist
-            if len(drugResist) != 0 and drugsResisted == len(drugResist):
-                virus_pop += 1
-        
-        return virus_pop
+        drugMask = DRUG_REGISTRY.mask(drugResist)
+        return sum(count for resistances, count in self.census.items() if resistances & drugMask == drugMask)
+
+    def fork(self, rng=None):
+        """
+        Snapshot of this patient that evolves independently from here on,
+        e.g. to branch one drug-free history into several treatments.
+
+        The population list is shared copy-on-write: update() never changes
+        a list in place but replaces it, and particles never change after
+        they are born, so forking costs O(resistance masks) rather than
+        O(population).
+
+        rng: random number generator of the copy (shared with this patient
+        if None, in which case the two draw from one stream)
+
+        returns: a copy of this patient
+        """
+        twin = copy.copy(self)
+        twin.census = collections.Counter(self.census)
+        twin.administeredDrugs = list(self.administeredDrugs)
+        if rng is not None:
+            twin.rng = rng
+            if self.mutationRng is not None:
+                twin.mutationRng = numpy.random.RandomState(rng.getrandbits(32))
+        return twin
 
     def update(self):
         """
@@ -202,20 +392,39 @@ class Patient(SimplePatient):
         returns: The total virus population at the end of the update (an integer)
         """
 
+        profile = self.profile
+        if profile is not None:
+            profile.startStep(len(self.viruses))
+            profile.rngDraws += len(self.viruses)
+
         # Determine how many viruses survive
+        survivors = []
+        cleared = []
         for virus in self.viruses:
-            if virus.doesClear():
-                self.viruses.remove(virus)
+            if virus.doesClear(self.rng):
+                cleared.append(virus)
+            else:
+                survivors.append(virus)
+        self.viruses = survivors
+        if profile is not None:
+            profile.lap('clearance')
+
+        for virus in cleared:
+            self.census[virus.resistanceMask()] -= 1
+        if profile is not None:
+            profile.lap('census')
 
         popDensity = self.getTotalPop() / float(self.maxPop)
+        if profile is not None:
+            profile.lap('density')
 
-        offspringViruses = []
-        for virus in self.viruses:
-            try:
-                offspringViruses.append(virus.reproduce(popDensity, self.administeredDrugs))
-            except NoChildException:
-                pass
+        offspringViruses = resistantOffspringOf(self.viruses, popDensity, self.activeMask, self.rng, profile, \
+            self.mutationRng)
+        for childOfVirus in offspringViruses:
+            self.census[childOfVirus.resistanceMask()] += 1
         self.viruses = self.viruses + offspringViruses
+        if profile is not None:
+            profile.lap('census')
 
         return self.getTotalPop()
 
@@ -229,59 +438,26 @@ def resistantVirusCollection(numViruses, maxBirthProb, clearProb, resistances, m
     return viruses
 
 
-def simulationWithDrug(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug='guttagonol'):
+def plotTrajectories(dataMatrixTotal, dataMatrixDrugResistant, numTimeStepsBeforeDrug, drug):
     '''
-    Runs simulations when only one drug is administered to a 
-    Patient with ResistantVirus particles.
-
-    The simulation consists of consists of 150 time steps, 
-    followed by the addition of the drug, 
-    guttagonol, followed by another 150 time steps.
-
-    Returns the final total populations from all of the trials
+    Plots the average total and drug resistant populations of a set of
+    trials (with 95% error bars) and saves the figure as a PNG file.
     '''
-
-    # To get same random results
-    random.seed(0)
-
-    maxPop = 1000 # maximum sustainable virus population
-    numViruses = 100 # initial number of viruses
-    numTimeSteps = numTimeStepsBeforeDrug + numTimeStepsAfterDrug
-
-    # Virus Characteristics
-    maxBirthProb = 0.1
-    clearProb = 0.05
-    resistances = {'guttagonol': False}
-    mutProb = 0.005
-
-    dataMatrixTotal = numpy.zeros(shape=(numTrials, numTimeSteps))
-    dataMatrixDrugResistant = numpy.zeros(shape=(numTrials, numTimeSteps))
-
-    for trial in range(numTrials):
-        # print "trial =", trial
-        # Model a random patient with the given virus charateristics
-        viruses = resistantVirusCollection(numViruses, maxBirthProb, clearProb, resistances, mutProb)
-        randPatientX = Patient(viruses, maxPop)
-
-        # Simulate the time-steps
-        for time in range(numTimeSteps):
-            if time == numTimeStepsBeforeDrug:
-                randPatientX.addPrescription(drug)
-            if time == 0:
-                dataMatrixTotal[trial][0] = randPatientX.getTotalPop()
-                dataMatrixDrugResistant[trial][0] = randPatientX.getResistPop([drug])
-            else:
-                dataMatrixTotal[trial][time] = randPatientX.update()
-                dataMatrixDrugResistant[trial][time] = randPatientX.getResistPop([drug])
-    
-    finalTotalPopulations = list(dataMatrixTotal[:,-1])
-    
     # Statistical Analysis.
-    meanDataTotal = dataMatrixTotal.mean(0)
-    meanDataDrugResistant = dataMatrixDrugResistant.mean(0)
+    plotTrajectoryStats(len(dataMatrixTotal), dataMatrixTotal.mean(0), dataMatrixTotal.std(0), \
+        dataMatrixDrugResistant.mean(0), dataMatrixDrugResistant.std(0), numTimeStepsBeforeDrug, drug)
+
+def plotTrajectoryStats(numTrials, meanDataTotal, stdDataTotal, meanDataDrugResistant, stdDataDrugResistant, \
+    numTimeStepsBeforeDrug, drug):
+    '''
+    Same as plotTrajectories(), from the per-time-step means and standard
+    deviations of the trials (e.g. kept by a virussim.stats.TrajectoryStats).
+    '''
+    import pylab
+    numTimeSteps = len(meanDataTotal)
     time = numpy.arange(numTimeSteps)
-    stdDataTotal = dataMatrixTotal.std(0) * 2
-    stdDataDrugResistant = dataMatrixDrugResistant.std(0) * 2
+    stdDataTotal = stdDataTotal * 2
+    stdDataDrugResistant = stdDataDrugResistant * 2
     selectedTime = numpy.arange(0, numTimeSteps, 10)
 
     pylab.clf()
@@ -303,24 +479,186 @@ def simulationWithDrug(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAft
     figure_name = drug + "_nt_" + str(numTrials) + "_ntsbd_" + str(numTimeStepsBeforeDrug) + ".png"
     pylab.savefig(figure_name)
 
+def simulationWithDrug(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug='guttagonol', \
+    engine='particle', workers=1, cache=None, keepTrajectories=True, store=None, archive=None, catalog=None):
+    '''
+    Runs simulations when only one drug is administered to a 
+    Patient with ResistantVirus particles.
+
+    The simulation consists of consists of 150 time steps, 
+    followed by the addition of the drug, 
+    guttagonol, followed by another 150 time steps.
+
+    engine selects how each patient is simulated, see simulateTrajectories().
+
+    workers: number of processes the trials are spread over, see
+    virussim.runner.runTrials (1 runs them in this process)
+
+    cache: a virussim.cache.ResultCache; trajectories already stored in it
+    are loaded instead of simulated
+
+    keepTrajectories: if False, the trials are summarized as they finish by
+    virussim.stats.TrajectoryStats instead of being kept in numTrials x
+    numTimeSteps matrices, so memory does not grow with numTrials (the
+    cache is not used then)
+
+    store: a directory; if given, the trajectory matrices are kept in a
+    virussim.store.TrajectoryStore there (numpy.memmap files written a
+    chunk of trials at a time) instead of in memory, and can be reopened
+    for later analysis (the cache is not used then)
+
+    archive: a file path; if given, the trials are also written to a
+    virussim.archive trajectory archive as they finish, and are summarized
+    as with keepTrajectories=False unless a store is given (the cache is
+    not used then)
+
+    catalog: a virussim.catalog.RunCatalog the run is recorded in
+
+    Returns the final total populations from all of the trials
+    '''
+
+    startTime = time.time()
+    params = cacheParameters(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, 0)
+
+    if store is not None:
+        finalTotalPopulations, finalResistantPopulations = storedSimulationWithDrug(numTrials, \
+            numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, workers, store, archive)
+    elif not keepTrajectories or archive is not None:
+        finalTotalPopulations, finalResistantPopulations = streamingSimulationWithDrug(numTrials, \
+            numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, workers, archive)
+    else:
+        finalTotalPopulations, finalResistantPopulations = cachedSimulationWithDrug(params, \
+            numTimeStepsBeforeDrug, drug, workers, cache)
+
+    if catalog is not None:
+        from virussim.catalog import runRecord
+        catalog.record(runRecord('simulationWithDrug', params, time.time() - startTime, finalTotalPopulations, \
+            finalResistantPopulations))
+
     return finalTotalPopulations
 
-def simulationDelayedTreatment(numTrials=10, numTimeStepsBeforeDrug=150, \
-    numTimeStepsAfterDrug=150, drug='guttagonol'):
+def cachedSimulationWithDrug(params, numTimeStepsBeforeDrug, drug, workers, cache):
     '''
-    Runs the simulation for delayed treatment by the
-    admninistration of only one drug.
+    simulationWithDrug() with the trajectory matrices in memory, loaded
+    from the cache when it has them.
+
+    Returns a tuple (finalTotalPopulations, finalResistantPopulations) of lists
+    '''
+    numTrials, engine = params['numTrials'], params['engine']
+    numTimeStepsAfterDrug = params['numTimeSteps'] - numTimeStepsBeforeDrug
+    cached = cache.get(params) if cache is not None else None
+
+    if cached is not None:
+        dataMatrixTotal = cached['total'].astype(float)
+        dataMatrixDrugResistant = cached['resistant'].astype(float)
+    elif workers == 1:
+        dataMatrixTotal, dataMatrixDrugResistant = simulateTrajectories(numTrials, numTimeStepsBeforeDrug, \
+            numTimeStepsAfterDrug, drug, engine)
+    else:
+        from virussim.runner import runTrials
+        dataMatrixTotal, dataMatrixDrugResistant = runTrials(numTrials, numTimeStepsBeforeDrug, \
+            numTimeStepsAfterDrug, drug, engine, maxWorkers=workers)
+
+    if cache is not None and cached is None:
+        cache.put(params, {'total': dataMatrixTotal.astype(numpy.int32), \
+            'resistant': dataMatrixDrugResistant.astype(numpy.int32)})
+
+    finalTotalPopulations = list(dataMatrixTotal[:,-1])
+    plotTrajectories(dataMatrixTotal, dataMatrixDrugResistant, numTimeStepsBeforeDrug, drug)
 
+    return finalTotalPopulations, list(dataMatrixDrugResistant[:,-1])
+
+def trajectoryBlocks(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, workers, \
+    archive=None):
+    '''
+    Yields the (totalPop, resistPop) blocks of the trials, simulated in
+    this process or by virussim.runner.iterateTrials, and appends each of
+    them to the archive file (if one is given) before passing it on.
+    '''
+    if workers == 1:
+        blocks = iterateTrajectories(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine)
+    else:
+        from virussim.runner import iterateTrials
+        blocks = iterateTrials(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, \
+            maxWorkers=workers)
+    if archive is None:
+        for block in blocks:
+            yield block
+        return
+
+    from virussim.archive import ArchiveWriter
+    params = cacheParameters(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, 0)
+    with ArchiveWriter(archive, params, numTimeStepsBeforeDrug + numTimeStepsAfterDrug) as writer:
+        for totalPop, resistPop in blocks:
+            writer.write(totalPop, resistPop)
+            yield totalPop, resistPop
+
+def streamingSimulationWithDrug(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, workers, \
+    archive=None):
+    '''
+    simulationWithDrug(keepTrajectories=False): the trajectories are folded
+    into TrajectoryStats as they are produced and then dropped.
+
+    Returns a tuple (finalTotalPopulations, finalResistantPopulations) of lists
+    '''
+    from virussim.stats import TrajectoryStats
+
+    numTimeSteps = numTimeStepsBeforeDrug + numTimeStepsAfterDrug
+    statsTotal = TrajectoryStats(numTimeSteps)
+    statsDrugResistant = TrajectoryStats(numTimeSteps)
+    finalTotalPopulations = []
+    finalResistantPopulations = []
+
+    blocks = trajectoryBlocks(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, workers, \
+        archive)
+    for totalPop, resistPop in blocks:
+        statsTotal.add(totalPop)
+        statsDrugResistant.add(resistPop)
+        finalTotalPopulations.extend(numpy.atleast_2d(totalPop)[:, -1])
+        finalResistantPopulations.extend(numpy.atleast_2d(resistPop)[:, -1])
+
+    plotTrajectoryStats(numTrials, statsTotal.mean, statsTotal.std(), statsDrugResistant.mean, \
+        statsDrugResistant.std(), numTimeStepsBeforeDrug, drug)
+
+    return finalTotalPopulations, finalResistantPopulations
+
+def storedSimulationWithDrug(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, workers, \
+    directory, archive=None):
+    '''
+    simulationWithDrug(store=directory): the trajectories are written to a
+    TrajectoryStore and reduced from there a chunk of trials at a time.
+
+    Returns a tuple (finalTotalPopulations, finalResistantPopulations) of lists
+    '''
+    from virussim.store import TrajectoryStore, chunkedStats
+
+    store = TrajectoryStore(directory, numTrials, numTimeStepsBeforeDrug + numTimeStepsAfterDrug, 'w+')
+    store.fill(trajectoryBlocks(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, workers, \
+        archive))
+
+    statsTotal = chunkedStats(store.total)
+    statsDrugResistant = chunkedStats(store.resistant)
+    plotTrajectoryStats(numTrials, statsTotal.mean, statsTotal.std(), statsDrugResistant.mean, \
+        statsDrugResistant.std(), numTimeStepsBeforeDrug, drug)
+
+    return list(store.total[:, -1].astype(float)), list(store.resistant[:, -1].astype(float))
+
+def curedPercentage(finalTotalPopulations):
+    '''
     Returns the percentage of the cured patients on the
     assumption that a final virus population of 0-50 in
     a patient means they are cured.
     '''
-
-    finalTotalPopulations = simulationWithDrug(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug)
-
-    # Find out the percentage of cured patients
     curedPatientsVirusPopulations = [population for population in finalTotalPopulations if population <= 50]
-    curedPatientPercentage = len(curedPatientsVirusPopulations) / float(len(finalTotalPopulations)) * 100
+    return len(curedPatientsVirusPopulations) / float(len(finalTotalPopulations)) * 100
+
+def plotFinalPopulations(finalTotalPopulations, numTimeStepsBeforeDrug, drug):
+    '''
+    Plots the histogram of the final total populations of a set of trials
+    and saves it as a PNG file.
+    '''
+    import pylab
+    numTrials = len(finalTotalPopulations)
 
     ## Make histogram
     pylab.clf()
@@ -337,17 +675,86 @@ def simulationDelayedTreatment(numTrials=10, numTimeStepsBeforeDrug=150, \
     fileName = "hist_" + drug + "_nt_" + str(numTrials) + "_ntsbd_" + str(numTimeStepsBeforeDrug) + "_steps.png"
     pylab.savefig(fileName)
 
+def simulationDelayedTreatment(numTrials=10, numTimeStepsBeforeDrug=150, \
+    numTimeStepsAfterDrug=150, drug='guttagonol', engine='particle', workers=1, cache=None, \
+    keepTrajectories=True, store=None, archive=None, catalog=None):
+    '''
+    Runs the simulation for delayed treatment by the
+    admninistration of only one drug.
+
+    Returns the percentage of the cured patients on the
+    assumption that a final virus population of 0-50 in
+    a patient means they are cured.
+    '''
+
+    finalTotalPopulations = simulationWithDrug(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, \
+        engine, workers, cache, keepTrajectories, store, archive, catalog)
+
+    # Find out the percentage of cured patients
+    curedPatientPercentage = curedPercentage(finalTotalPopulations)
+    plotFinalPopulations(finalTotalPopulations, numTimeStepsBeforeDrug, drug)
+
     return curedPatientPercentage
 
+def sequentialDelayedTreatment(numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug='guttagonol', \
+    engine='particle', targetWidth=2.0, maxTrials=2000, batchSize=50, workers=1):
+    '''
+    Runs the simulation for delayed treatment like
+    simulationDelayedTreatment, but instead of a fixed
+    number of trials runs batches of batchSize trials until
+    the 95% confidence interval of the cured percentage is
+    at most targetWidth percentage points wide or maxTrials
+    trials have been run.
+
+    Returns a virussim.sequential.CureRateEstimate with the
+    cured percentage, its interval and the number of trials.
+    '''
+    from virussim.sequential import estimateCureRate
+
+    if workers == 1:
+        estimate = estimateCureRate(numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, targetWidth, \
+            batchSize=batchSize, maxTrials=maxTrials)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            estimate = estimateCureRate(numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, \
+                targetWidth, batchSize=batchSize, maxTrials=maxTrials, executor=executor)
+
+    plotFinalPopulations(estimate.finalTotalPopulations, numTimeStepsBeforeDrug, drug)
+    return estimate
+
 if __name__ == '__main__':
+    from virussim.cache import ResultCache
+    from virussim.catalog import RunCatalog, runRecord
+    from virussim.runner import runDelayedTreatmentSweep
+
     # problems 2 and 3
     trials = 500
     BEFORE_DRUG_STEPS = [300, 150, 75, 0]
+    WORKERS = None # number of worker processes, None uses every core
+
+    # All scenarios and trials are fanned out over one process pool;
+    # scenarios simulated before are loaded from the cache
+    startTime = time.time()
+    results = runDelayedTreatmentSweep(BEFORE_DRUG_STEPS, trials, maxWorkers=WORKERS, \
+        cache=ResultCache('simulation_cache'))
+    wallTime = time.time() - startTime
+
+    # Every scenario is recorded with the wall time of the whole sweep
+    with RunCatalog() as catalog:
+        for steps in BEFORE_DRUG_STEPS:
+            dataMatrixTotal, dataMatrixDrugResistant = results[steps]
+            catalog.record(runRecord('delayedTreatmentSweep', cacheParameters(trials, steps, 150, 'guttagonol', \
+                'particle', 0), wallTime, dataMatrixTotal[:,-1], dataMatrixDrugResistant[:,-1]))
 
     f_name = str(trials) + "_cured_percentages.txt"
     f = open(f_name, mode='w')
     for steps in BEFORE_DRUG_STEPS:
-       curedPatientPercentage = simulationDelayedTreatment(numTrials=trials, numTimeStepsBeforeDrug=steps)
+       dataMatrixTotal, dataMatrixDrugResistant = results[steps]
+       finalTotalPopulations = list(dataMatrixTotal[:,-1])
+       plotTrajectories(dataMatrixTotal, dataMatrixDrugResistant, steps, 'guttagonol')
+       plotFinalPopulations(finalTotalPopulations, steps, 'guttagonol')
+       curedPatientPercentage = curedPercentage(finalTotalPopulations)
        stirngToWrite = "Percentage of cured patients after {:d} steps: {:.2f}\n".format(steps, curedPatientPercentage) 
        f.write(stirngToWrite)   
     f.close()
@@ -1,8 +1,6 @@
 import numpy
 import random
-import pylab
 import collections
-import matplotlib.mlab as mlab
 
 from ps7_v1 import *
 
@@ -240,6 +238,7 @@ def simulationWithDrug(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAft
 
     Returns the final total populations from all of the trials
     '''
+    import pylab
 
     # To get same random results
     random.seed(0)
@@ -315,6 +314,7 @@ def simulationDelayedTreatment(numTrials=10, numTimeStepsBeforeDrug=150, \
     assumption that a final virus population of 0-50 in
     a patient means they are cured.
     '''
+    import pylab
 
     finalTotalPopulations = simulationWithDrug(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug)
 
@@ -342,37 +342,32 @@ def simulationDelayedTreatment(numTrials=10, numTimeStepsBeforeDrug=150, \
 
 
 
-def simulationWith2Drug(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug1='guttagonol',drug2 = 'grimpex'):
- # Virus Characteristics
-    maxBirthProb = 0.1
-    clearProb = 0.05
-    resistances = {'guttagonol':False, 'grimpex':False}
-    mutProb = 0.005
+def simulationWith2Drug(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug1='guttagonol', \
+    drug2='grimpex', lag=0, engine='particle'):
+    '''
+    Runs simulations when two drugs are administered to a Patient with
+    ResistantVirus particles.
 
-    dataMatrixTotal = numpy.zeros(shape=(numTrials, numTimeSteps))
-    dataMatrixDrugResistant = numpy.zeros(shape=(numTrials, numTimeSteps))
+    drug1 is added after numTimeStepsBeforeDrug time steps, drug2 lag time
+    steps later, followed by another numTimeStepsAfterDrug time steps. The
+    patients are simulated by ps8S2 following a
+    virussim.schedule.TreatmentSchedule (see ps8S2.simulateTrajectories
+    for the engines).
 
-    for trial in range(numTrials):
-        # print "trial =", trial
-        # Model a random patient with the given virus charateristics
-        viruses = resistantVirusCollection(numViruses, maxBirthProb, clearProb, resistances, mutProb)
-        randPatientX = Patient(viruses, maxPop)
+    Returns the final total populations from all of the trials
+    '''
+    import pylab
+    import ps8S2
+    from virussim.schedule import TreatmentSchedule
+
+    schedule = TreatmentSchedule([(numTimeStepsBeforeDrug, drug1), (numTimeStepsBeforeDrug + lag, drug2)])
+    numTimeSteps = numTimeStepsBeforeDrug + lag + numTimeStepsAfterDrug
+
+    dataMatrixTotal, dataMatrixDrugResistant = ps8S2.simulateTrajectories(numTrials, \
+        numTimeStepsBeforeDrug + lag, numTimeStepsAfterDrug, drug1, engine, schedule=schedule)
 
-        # Simulate the time-steps
-        for time,steps in range(numTimeSteps,[300,150,75,0]):
-            if time == numTimeStepsBeforeDrug:
-                randPatientX.addPrescription(drug1)
-            if time == numTimeStepsBeforeDrug+ steps :
-                randPatientX.addPrescription(drug2)
-            if time == 0:
-                dataMatrixTotal[trial][0] = randPatientX.getTotalPop()
-                dataMatrixDrugResistant[trial][0] = randPatientX.getResistPop([drug])
-            else:
-                dataMatrixTotal[trial][time] = randPatientX.update()
-                dataMatrixDrugResistant[trial][time] = randPatientX.getResistPop([drug])
-    
     finalTotalPopulations = list(dataMatrixTotal[:,-1])
-      # Statistical Analysis.
+    # Statistical Analysis.
     meanDataTotal = dataMatrixTotal.mean(0)
     meanDataDrugResistant = dataMatrixDrugResistant.mean(0)
     time = numpy.arange(numTimeSteps)
@@ -386,17 +381,18 @@ def simulationWith2Drug(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAf
     totalPop, = pylab.plot(time, meanDataTotal, color='green', label='Average Total Virus Population')
     pylab.errorbar(time[selectedTime], meanDataTotal[selectedTime], \
         stdDataTotal[selectedTime], fmt='go')
-    # Plot average drug resistant population
+    # Plot average population resistant to both drugs
     drugResistantPop, = pylab.plot(time, meanDataDrugResistant, color='red', \
-        label='Average '+ drug.capitalize() + ' Resistant Virus Population')
+        label='Average ' + drug1.capitalize() + ' and ' + drug2.capitalize() + ' Resistant Virus Population')
     pylab.errorbar(time[selectedTime], meanDataDrugResistant[selectedTime], \
         stdDataDrugResistant[selectedTime], fmt='ro')
     pylab.legend(loc = 1)
     pylab.xlabel("Number of Time Steps")
     pylab.ylabel("Average Virus Population")
-    pylab.title("Virus Population Dynamics Simulation with One Drug")
+    pylab.title("Virus Population Dynamics Simulation with Two Drugs")
     # pylab.show()
-    figure_name = drug + "_nt_" + str(numTrials) + "_ntsbd_" + str(numTimeStepsBeforeDrug) + ".png"
+    figure_name = drug1 + "_" + drug2 + "_nt_" + str(numTrials) + "_ntsbd_" + str(numTimeStepsBeforeDrug) + \
+        "_lag_" + str(lag) + ".png"
     pylab.savefig(figure_name)
 
     return finalTotalPopulations
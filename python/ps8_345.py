@@ -1,11 +1,10 @@
-import pylab
 import collections
+import time
 
 from ps7_v1 import *
-from ps8S1 import *
 
 
-def problem6():
+def problem6(catalog=None, engine='particle'):
     """
     Runs simulations and make histograms for problem 6.
     Runs multiple simulations to show the relationship between administration
@@ -13,24 +12,74 @@ def problem6():
     Histograms of final total virus populations are displayed for lag times of
     150, 75, 0 timesteps between adding drugs (followed by an additional 150
     timesteps of simulation).
+
+    The treatments are virussim.schedule.TreatmentSchedules; the patients
+    are simulated by ps8S2 with the given engine (see
+    ps8S2.resistantPatient). engine='batched' simulates the trials of all
+    four schedules together in one batch, and engine='tauleap' leaps
+    between prescriptions (see virussim.tauleap.recordTrajectory).
+
+    catalog: a virussim.catalog.RunCatalog every lag time is recorded in
     """
-    viruses = [ResistantVirus(0.1, 0.05, {'guttagonol':False, 'grimpex':False}, 0.005) for _ in range(100)]
+    import pylab
+    import ps8S2
+    from virussim.schedule import TreatmentSchedule
+
+    resistances = {'guttagonol':False, 'grimpex':False}
+    drugs = ['guttagonol', 'grimpex']
     num_trials = 30
+    lags = [300, 150, 75, 0]
     print '\n%d patients -- 150 time steps, add guttagonol, 300, 150, 75 and 0 time steps, add grimpex, 150 more time steps\n' % num_trials
 
-    delays = collections.defaultdict(list) # a dict of list, which contains the final virus population of each trial(patient)
+    # Step t of a schedule is the t-th update; guttagonol acts from the
+    # 152nd update on and grimpex from delay updates later, as when the
+    # drugs were added after the updates numbered 150 and delay + 150 from 0
+    schedules = dict((delay, TreatmentSchedule([(152, 'guttagonol'), (delay + 152, 'grimpex')])) for delay in lags)
 
-    for steps, delay in [(600,300), (450,150), (375,75), (300,0)]:
-        print '%d patients, 150 time steps, add guttagonol, %d time steps, add grimpex, 150 more time steps\n' % (num_trials, delay)
-        for n in range(num_trials):
-            patient = Patient(viruses, 1000)
-            for i in range(steps):
-                total = patient.update()
-                if i == 150:
-                    patient.addPrescription('guttagonol')
-                if i  == delay + 150:
-                    patient.addPrescription('grimpex')
-            delays[delay].append(total)
+    delays = collections.defaultdict(list) # a dict of list, which contains the final virus population of each trial(patient)
+    resistant = collections.defaultdict(list) # final populations resistant to both drugs
+    wallTimes = {}
+
+    if engine == 'batched':
+        from virussim.batched import simulateSchedules
+        # Every schedule runs for the 600 updates of the longest one; the
+        # final population of a lag is read after its 300 + delay updates
+        startTime = time.time()
+        dataMatrixTotal, dataMatrixDrugResistant = simulateSchedules([schedules[delay] for delay in lags], \
+            num_trials, 601, 100, 0.1, 0.05, resistances, 0.005, 1000, drugs)
+        for index, delay in enumerate(lags):
+            delays[delay] = list(dataMatrixTotal[index, :, 300 + delay])
+            resistant[delay] = list(dataMatrixDrugResistant[index, :, 300 + delay])
+            wallTimes[delay] = time.time() - startTime
+    else:
+        for delay in lags:
+            startTime = time.time()
+            print '%d patients, 150 time steps, add guttagonol, %d time steps, add grimpex, 150 more time steps\n' % (num_trials, delay)
+            for n in range(num_trials):
+                patient = ps8S2.resistantPatient(engine, 100, 0.1, 0.05, resistances, 0.005, 1000)
+                if engine == 'tauleap':
+                    from virussim.tauleap import recordTrajectory
+                    totalPop, resistPop = recordTrajectory(patient, 301 + delay, schedules[delay], drugs)
+                else:
+                    totalPop, resistPop = ps8S2.recordSchedule(patient, 301 + delay, schedules[delay], drugs)
+                delays[delay].append(totalPop[-1])
+                resistant[delay].append(resistPop[-1])
+            wallTimes[delay] = time.time() - startTime
+
+    if catalog is not None:
+        from virussim.catalog import runRecord
+        for delay in lags:
+            params = {'maxPop': 1000, 'numViruses': 100, 'maxBirthProb': 0.1, 'clearProb': 0.05,
+                      'resistances': resistances, 'mutProb': 0.005, 'numTrials': num_trials,
+                      'numTimeSteps': 301 + delay, 'engine': engine, 'seed': None,
+                      'schedule': [[step, drug] for step, action, drug in schedules[delay].events],
+                      'drugResist': drugs}
+            record = runRecord('problem6', params, wallTimes[delay], delays[delay], resistant[delay])
+            # The delay problem6 varies is the one between the two drugs, so
+            # it goes in 'delay' (as well as in 'lag', the gap between the
+            # first two scheduled drugs); guttagonol's start is in the params
+            record['delay'] = delay
+            catalog.record(record)
 
     cuered_rates = {}
     for k, v in delays.items():
@@ -46,37 +95,68 @@ def problem6():
 
     pylab.show()
 
-problem6()
 
 #
 # PROBLEM 7
 #
 
-def problem7():
+def resistanceTrajectories(patient, numTimeSteps, schedule):
+    """
+    Simulates one patient (see ps8S2.resistantPatient) under a treatment
+    schedule on the time grid of ps8S2.recordSchedule (step t of the
+    schedule is the t-th update), recording the populations that problem7
+    plots after every update. The resistant populations are read from the
+    patient's census, so recording costs no walk over the particles. A
+    virussim.tauleap.TauLeapPatient leaps between prescriptions (see
+    virussim.tauleap.recordResistances).
+
+    schedule: a virussim.schedule.TreatmentSchedule
+
+    returns: a tuple (total, guttagonol, grimpex, both) of lists with the
+    total, guttagonol-resistant, grimpex-resistant and doubly resistant
+    populations after each of the numTimeSteps updates
+    """
+    from virussim.tauleap import TauLeapPatient, recordResistances
+
+    drugGroups = [['guttagonol'], ['grimpex'], ['guttagonol', 'grimpex']]
+    if isinstance(patient, TauLeapPatient):
+        totalPop, resistPops = recordResistances(patient, numTimeSteps + 1, schedule, drugGroups)
+        return tuple(list(population[1:]) for population in [totalPop] + resistPops)
+
+    masks = schedule.compile(numTimeSteps + 1, patient.knownMask)
+    populations = ([], [], [], [])
+    for step in range(1, numTimeSteps + 1):
+        if masks[step] != patient.activeMask:
+            patient.setActiveMask(int(masks[step]))
+        populations[0].append(patient.update())
+        for population, drugResist in zip(populations[1:], drugGroups):
+            population.append(patient.getResistPop(drugResist))
+    return populations
+
+
+def problem7(engine='particle'):
     """
     Run simulations and plot graphs examining the relationship between
     administration of multiple drugs and patient outcome.
     Plots of total and drug-resistant viruses vs. time are made for a
     simulation with a 300 time step delay between administering the 2 drugs and
     a simulations for which drugs are administered simultaneously.
+
+    The patients are simulated by ps8S2 with the given engine (see
+    ps8S2.resistantPatient), as in problem6.
     """
-    viruses = [ResistantVirus(0.1, 0.05, {'guttagonol':False, 'grimpex':False}, 0.005) for _ in range(100)]
+    import pylab
+    import ps8S2
+    from virussim.schedule import TreatmentSchedule
+
+    resistances = {'guttagonol':False, 'grimpex':False}
 
+    # As in problem6, drugs added after update 150 (counting from 0) act
+    # from the 152nd update on
     print '150 time steps, add guttagonol, 300 time steps, add grimpex, 150 more time steps\n'
-    patient = Patient(viruses, 1000)
-    total_pop = []
-    resist_guttagonol_pop = []
-    resist_grimpex_pop = []
-    resist_both_pop = []
-    for i in range(600):
-        total_pop.append(patient.update())
-        resist_guttagonol_pop.append(patient.getResistPop(['guttagonol']))
-        resist_grimpex_pop.append(patient.getResistPop(['grimpex']))
-        resist_both_pop.append(patient.getResistPop(['guttagonol', 'grimpex']))
-        if i == 150:
-            patient.addPrescription('guttagonol')
-        if i  == 450:
-            patient.addPrescription('grimpex')
+    patient = ps8S2.resistantPatient(engine, 100, 0.1, 0.05, resistances, 0.005, 1000)
+    total_pop, resist_guttagonol_pop, resist_grimpex_pop, resist_both_pop = resistanceTrajectories(patient, 600, \
+        TreatmentSchedule([(152, 'guttagonol'), (452, 'grimpex')]))
 
     pylab.figure()
     pylab.plot(range(1,601), total_pop, color='red', label='total virus population')
@@ -91,19 +171,9 @@ def problem7():
 
 
     print '150 time steps, add guttagonol and grimpex simultaneoulsy, 150 more time steps'
-    patient = Patient(viruses, 1000)
-    total_pop = []
-    resist_guttagonol_pop = []
-    resist_grimpex_pop = []
-    resist_both_pop = []
-    for i in range(300):
-        total_pop.append(patient.update())
-        resist_guttagonol_pop.append(patient.getResistPop(['guttagonol']))
-        resist_grimpex_pop.append(patient.getResistPop(['grimpex']))
-        resist_both_pop.append(patient.getResistPop(['guttagonol', 'grimpex']))
-        if i == 150:
-            patient.addPrescription('guttagonol')
-            patient.addPrescription('grimpex')
+    patient = ps8S2.resistantPatient(engine, 100, 0.1, 0.05, resistances, 0.005, 1000)
+    total_pop, resist_guttagonol_pop, resist_grimpex_pop, resist_both_pop = resistanceTrajectories(patient, 300, \
+        TreatmentSchedule([(152, 'guttagonol'), (152, 'grimpex')]))
 
     pylab.figure()
     pylab.plot(range(1,301), total_pop, color='red', label='total virus population')
@@ -119,4 +189,6 @@ def problem7():
     pylab.show() # show the figure
 
 
-#problem7()
+if __name__ == '__main__':
+    problem6()
+    #problem7()
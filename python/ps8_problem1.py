@@ -1,6 +1,5 @@
 import numpy
 import random
-import pylab
 from ps7 import SimplePatient
 
 ''' 
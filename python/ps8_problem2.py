@@ -1,6 +1,5 @@
 import numpy
 import random
-import pylab
 
 from ps7 import *
 
@@ -165,6 +164,7 @@ def simulationWithDrug(numTrials = 20, numTimeSteps = 150):
     Instantiates a patient, runs a simulation for 300 timesteps, and plots the
     total virus population as a function of time.
     """
+    import pylab
     random.seed()
 
     # Virus Characteristics.
@@ -215,4 +215,5 @@ def simulationWithDrug(numTrials = 20, numTimeSteps = 150):
    
     
     
-simulationWithDrug()
+if __name__ == '__main__':
+    simulationWithDrug()
@@ -0,0 +1,135 @@
+"""
+Consistency checks of the simulation engines of ps8S2 and virussim, with
+fixed seeds and small trial counts:
+
+- the engines agree statistically with the particle engine
+- the census of a Patient matches a rescan of its particles
+- profiled updates reproduce unprofiled ones
+- the results of virussim.runner do not depend on the worker count
+
+Run with python -m unittest test_engines (or pytest) from this directory.
+"""
+
+import random
+import unittest
+
+import numpy
+
+import ps7_v1
+from virussim.model import MUTATION_KERNEL_DRUGS, resistantPatient
+from virussim.profiling import UpdateProfile
+from virussim.runner import runDelayedTreatmentSweep, runTrials
+from virussim.trials import BATCHED_BLOCK_TRIALS, simulateForkedTrajectories, simulateTrajectories
+
+
+class EngineAgreementTest(unittest.TestCase):
+
+    NUM_TRIALS = 80
+
+    def finalPopulations(self, engine):
+        dataMatrixTotal = simulateTrajectories(self.NUM_TRIALS, 100, 60, 'guttagonol', engine, seed=1)[0]
+        return dataMatrixTotal[:, 99], dataMatrixTotal[:, -1]
+
+    def assertAgree(self, populations, reference):
+        # Within four standard errors of the difference of the means
+        error = numpy.sqrt(populations.var() / len(populations) + reference.var() / len(reference))
+        self.assertLess(abs(populations.mean() - reference.mean()), 4 * error + 1)
+
+    def testEnginesAgreeWithParticles(self):
+        beforeDrug, afterDrug = self.finalPopulations('particle')
+        for engine in ('genotype', 'sparse', 'tauleap', 'batched'):
+            engineBeforeDrug, engineAfterDrug = self.finalPopulations(engine)
+            self.assertAgree(engineBeforeDrug, beforeDrug)
+            self.assertAgree(engineAfterDrug, afterDrug)
+
+
+class CensusTest(unittest.TestCase):
+
+    DRUGS = ['guttagonol', 'grimpex']
+
+    def rescan(self, patient, drugs):
+        return sum(1 for virus in patient.viruses if all(virus.isResistantTo(drug) for drug in drugs))
+
+    def assertCensus(self, patient):
+        for drugs in (['guttagonol'], ['grimpex'], self.DRUGS):
+            self.assertEqual(patient.getResistPop(drugs), self.rescan(patient, drugs))
+
+    def testCensusMatchesRescan(self):
+        patient = resistantPatient('particle', 100, 0.1, 0.05, {'guttagonol': False, 'grimpex': True}, 0.05,
+                                   1000, random.Random(2))
+        for step in range(120):
+            if step == 60:
+                patient.addPrescription('guttagonol')
+            patient.update()
+            self.assertCensus(patient)
+
+        branch = patient.fork(random.Random(3))
+        branch.addPrescription('grimpex')
+        for step in range(20):
+            branch.update()
+        self.assertCensus(branch)
+        self.assertCensus(patient)
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def trajectories(self, makePatient, numSteps, profiled):
+        patient = makePatient()
+        if profiled:
+            patient.profile = UpdateProfile()
+        return [patient.update() for step in range(numSteps)], patient.profile
+
+    def assertProfiledReproduces(self, makePatient, numSteps=120):
+        trajectory = self.trajectories(makePatient, numSteps, False)[0]
+        profiledTrajectory, profile = self.trajectories(makePatient, numSteps, True)
+        self.assertEqual(profiledTrajectory, trajectory)
+        self.assertEqual(profile.steps, numSteps)
+        self.assertGreater(profile.rngDraws, 0)
+
+    def testSimplePatient(self):
+        self.assertProfiledReproduces(lambda: ps7_v1.SimplePatient(ps7_v1.virusCollection(100, 0.1, 0.05), 1000,
+                                                                   random.Random(4)))
+
+    def testArraySimplePatient(self):
+        self.assertProfiledReproduces(lambda: ps7_v1.ArraySimplePatient(ps7_v1.virusCollection(100, 0.1, 0.05),
+                                                                        1000, numpy.random.RandomState(4)))
+
+    def testPatient(self):
+        # Two drugs mutate trait by trait, eight with the vectorized kernel
+        for numDrugs in (2, MUTATION_KERNEL_DRUGS):
+            resistances = dict(('drug%d' % drug, False) for drug in range(numDrugs))
+            self.assertProfiledReproduces(lambda: resistantPatient('particle', 100, 0.1, 0.05, resistances, 0.005,
+                                                                   1000, random.Random(5)))
+
+
+class WorkerCountTest(unittest.TestCase):
+
+    def assertSameMatrices(self, matrices, reference):
+        for matrix, referenceMatrix in zip(matrices, reference):
+            self.assertTrue(numpy.array_equal(matrix, referenceMatrix))
+
+    def testParticleTrials(self):
+        reference = simulateTrajectories(12, 30, 30, 'guttagonol', 'particle', seed=6)
+        for workers in (1, 3):
+            self.assertSameMatrices(runTrials(12, 30, 30, 'guttagonol', 'particle', chunkSize=5, seed=6,
+                                              maxWorkers=workers), reference)
+
+    def testBatchedTrials(self):
+        # More than one block, so that the blocks are split over the workers
+        numTrials = BATCHED_BLOCK_TRIALS + 100
+        reference = simulateTrajectories(numTrials, 20, 20, 'guttagonol', 'batched', seed=6)
+        for workers in (1, 2):
+            self.assertSameMatrices(runTrials(numTrials, 20, 20, 'guttagonol', 'batched', seed=6,
+                                              maxWorkers=workers), reference)
+
+    def testForkedSweep(self):
+        reference = simulateForkedTrajectories(12, [20, 10], 20, 'guttagonol', 'genotype', seed=6)
+        for workers in (1, 3):
+            results = runDelayedTreatmentSweep([20, 10], 12, 20, 'guttagonol', 'genotype', chunkSize=5, seed=6,
+                                               maxWorkers=workers, forked=True)
+            for delay in reference:
+                self.assertSameMatrices(results[delay], reference[delay])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,8 @@
+"""
+Alternative simulation engines for the virus population models of
+ps7_v1 and ps8S2.
+
+Importing these modules (or ps7_v1, ps8S1, ps8S2, ps8S4 and ps8_345) runs
+no simulation and does not load matplotlib; pylab is imported by the
+functions that plot, when they are called.
+"""
@@ -0,0 +1,238 @@
+"""
+Compressed, randomly accessible archive of simulated trajectories.
+
+An archive file consists of
+
+    MAGIC, a uint32 header length and a JSON header (the run parameters,
+    numTimeSteps and chunkTrials);
+
+    chunks, each a record (firstTrial, numTrials, length) of uint32s
+    followed by length bytes: the zlib-compressed int32 total and drug
+    resistant populations of numTrials trials, delta-encoded along time
+    (the first value of every trajectory, then the changes between steps);
+
+    the index, an int64 array of (firstTrial, numTrials, offset) rows, one
+    per chunk, followed by its byte length (uint64) and INDEX_MAGIC.
+
+Chunks are appended as the trials finish; the index is written when the
+archive is closed. An archive that was never closed (e.g. an interrupted
+sweep) is still readable: its index is rebuilt by scanning the chunk
+records. Readers decompress only the chunk holding the requested trial.
+"""
+
+import json
+import struct
+import zlib
+
+import numpy
+
+MAGIC = b'VSARCH1\n'
+INDEX_MAGIC = b'VSINDEX1'
+
+# Default number of trials per compressed chunk
+CHUNK_TRIALS = 50
+
+CHUNK_RECORD = struct.Struct('<III')
+
+
+def deltaEncode(matrix):
+    """
+    returns: the int32 trials x numTimeSteps matrix of the first value of
+    every row followed by its successive differences
+    """
+    matrix = numpy.asarray(matrix, dtype=numpy.int32)
+    deltas = numpy.empty_like(matrix)
+    deltas[:, 0] = matrix[:, 0]
+    deltas[:, 1:] = numpy.diff(matrix, axis=1)
+    return deltas
+
+
+def deltaDecode(deltas):
+    """
+    returns: the matrix deltaEncode() was called on
+    """
+    return numpy.cumsum(deltas, axis=1, dtype=numpy.int32)
+
+
+class ArchiveWriter(object):
+    """
+    Appends trajectories to a new archive file.
+    """
+
+    def __init__(self, path, params, numTimeSteps, chunkTrials=CHUNK_TRIALS, level=6):
+        """
+        path: the archive file (overwritten)
+
+        params: the parameters of the run (a JSON-serializable dict, e.g.
+        virussim.trials.cacheParameters())
+
+        chunkTrials: number of trials compressed together; smaller chunks
+        make random access cheaper and compression slightly worse
+
+        level: the zlib compression level
+        """
+        self.numTimeSteps = numTimeSteps
+        self.chunkTrials = chunkTrials
+        self.level = level
+        self.numTrials = 0
+        self.index = []
+        self.pendingTotal = []
+        self.pendingResist = []
+        self.file = open(path, 'wb')
+        header = json.dumps({'params': params, 'numTimeSteps': numTimeSteps, 'chunkTrials': chunkTrials},
+                            sort_keys=True).encode('utf-8')
+        self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    def write(self, totalPop, resistPop):
+        """
+        Adds the trajectories of the next trial (arrays of numTimeSteps
+        populations) or trials (trials x numTimeSteps arrays).
+        """
+        for total, resist in zip(numpy.atleast_2d(totalPop), numpy.atleast_2d(resistPop)):
+            self.pendingTotal.append(total)
+            self.pendingResist.append(resist)
+            if len(self.pendingTotal) == self.chunkTrials:
+                self.flush()
+
+    def flush(self):
+        """
+        Compresses and appends the trials written since the last chunk.
+        """
+        if not self.pendingTotal:
+            return
+        numTrials = len(self.pendingTotal)
+        data = numpy.concatenate([deltaEncode(self.pendingTotal), deltaEncode(self.pendingResist)])
+        compressed = zlib.compress(data.astype('<i4').tobytes(), self.level)
+        self.index.append((self.numTrials, numTrials, self.file.tell()))
+        self.file.write(CHUNK_RECORD.pack(self.numTrials, numTrials, len(compressed)) + compressed)
+        self.file.flush()
+        self.numTrials += numTrials
+        self.pendingTotal = []
+        self.pendingResist = []
+
+    def close(self):
+        """
+        Writes the last chunk and the index and closes the file.
+        """
+        if self.file.closed:
+            return
+        self.flush()
+        index = numpy.array(self.index, dtype='<i8').reshape(-1, 3).tobytes()
+        self.file.write(index + struct.pack('<Q', len(index)) + INDEX_MAGIC)
+        self.file.close()
+
+
+class TrajectoryArchive(object):
+    """
+    Read access to an archive; trials are decompressed on demand.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a trajectory archive!' % path)
+        headerLength = struct.unpack('<I', self.file.read(4))[0]
+        header = json.loads(self.file.read(headerLength).decode('utf-8'))
+        self.params = header['params']
+        self.numTimeSteps = header['numTimeSteps']
+        self.dataStart = len(MAGIC) + 4 + headerLength
+        self.index = self.readIndex()
+        self.numTrials = int(self.index[-1][0] + self.index[-1][1]) if len(self.index) else 0
+        self.cachedChunk = (None, None)
+
+    def readIndex(self):
+        """
+        returns: the (firstTrial, numTrials, offset) rows of the chunks, from
+        the stored index or, if the archive was not closed, from the chunk
+        records
+        """
+        self.file.seek(0, 2)
+        end = self.file.tell()
+        footer = 8 + len(INDEX_MAGIC)
+        if end - self.dataStart >= footer:
+            self.file.seek(end - footer)
+            tail = self.file.read(footer)
+            if tail[8:] == INDEX_MAGIC:
+                indexLength = struct.unpack('<Q', tail[:8])[0]
+                self.dataEnd = end - footer - indexLength
+                self.file.seek(self.dataEnd)
+                return numpy.frombuffer(self.file.read(indexLength), dtype='<i8').reshape(-1, 3)
+
+        index = []
+        offset = self.dataStart
+        while offset + CHUNK_RECORD.size <= end:
+            self.file.seek(offset)
+            firstTrial, numTrials, length = CHUNK_RECORD.unpack(self.file.read(CHUNK_RECORD.size))
+            if offset + CHUNK_RECORD.size + length > end:
+                break  # truncated last chunk
+            index.append((firstTrial, numTrials, offset))
+            offset += CHUNK_RECORD.size + length
+        self.dataEnd = offset
+        return numpy.array(index, dtype='<i8').reshape(-1, 3)
+
+    def __len__(self):
+        return self.numTrials
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    def chunk(self, chunkNumber):
+        """
+        returns: a tuple (firstTrial, totalPop, resistPop) with the int32
+        trials x numTimeSteps matrices of one chunk
+        """
+        if self.cachedChunk[0] == chunkNumber:
+            return self.cachedChunk[1]
+        firstTrial, numTrials, offset = (int(value) for value in self.index[chunkNumber])
+        self.file.seek(offset)
+        length = CHUNK_RECORD.unpack(self.file.read(CHUNK_RECORD.size))[2]
+        data = numpy.frombuffer(zlib.decompress(self.file.read(length)), dtype='<i4')
+        data = deltaDecode(data.reshape(2 * numTrials, self.numTimeSteps))
+        result = (firstTrial, data[:numTrials], data[numTrials:])
+        self.cachedChunk = (chunkNumber, result)
+        return result
+
+    def trial(self, trial):
+        """
+        returns: a tuple (totalPop, resistPop) with the trajectories of one
+        trial
+        """
+        if not 0 <= trial < self.numTrials:
+            raise IndexError('trial %d is not in the archive' % trial)
+        chunkNumber = numpy.searchsorted(self.index[:, 0], trial, side='right') - 1
+        firstTrial, totalPop, resistPop = self.chunk(chunkNumber)
+        return totalPop[trial - firstTrial], resistPop[trial - firstTrial]
+
+    def blocks(self):
+        """
+        Yields the (totalPop, resistPop) matrices of one chunk at a time, in
+        trial order (e.g. for virussim.stats.TrajectoryStats).
+        """
+        for chunkNumber in range(len(self.index)):
+            firstTrial, totalPop, resistPop = self.chunk(chunkNumber)
+            yield totalPop, resistPop
+
+    def load(self):
+        """
+        returns: a tuple (dataMatrixTotal, dataMatrixDrugResistant) of
+        numTrials x numTimeSteps float arrays with every trial
+        """
+        dataMatrixTotal = numpy.zeros((self.numTrials, self.numTimeSteps))
+        dataMatrixDrugResistant = numpy.zeros((self.numTrials, self.numTimeSteps))
+        for chunkNumber in range(len(self.index)):
+            firstTrial, totalPop, resistPop = self.chunk(chunkNumber)
+            dataMatrixTotal[firstTrial:firstTrial + len(totalPop)] = totalPop
+            dataMatrixDrugResistant[firstTrial:firstTrial + len(resistPop)] = resistPop
+        return dataMatrixTotal, dataMatrixDrugResistant
@@ -0,0 +1,223 @@
+"""
+Batched multi-trial engine for the drug resistance model of ps8S2.
+
+Holds the genotype counts of every trial as one trials x genotypes array
+and advances all trials in lockstep, so a time step is a handful of
+vectorized binomial draws instead of one update() call per patient.
+"""
+
+import copy
+
+import numpy
+
+from virussim.genotypes import initialCounts, resistantGenotypes, stepCounts
+from virussim.model import DrugRegistry
+from virussim.schedule import asSchedule, maskChanges
+
+
+class BatchedPatients(object):
+    """
+    numTrials independent patients with identical virus parameters. Offers
+    the methods of ps8S2.Patient, returning one value per trial (an integer
+    array) wherever Patient returns a single population.
+    """
+
+    def __init__(self, counts, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng=None):
+        """
+        Initialization function.
+
+        counts: number of particles per trial and genotype (a trials x
+        2^len(drugs) integer array; bit i of a genotype is resistance to
+        drugs[i])
+
+        drugs, maxBirthProb, clearProb, mutProb, maxPop, rng: as in
+        virussim.genotypes.GenotypePatient
+        """
+        self.registry = DrugRegistry(drugs)
+        self.counts = numpy.array(counts, dtype=numpy.int64)
+        if self.counts.ndim != 2 or self.counts.shape[1] != 2 ** len(self.registry):
+            raise ValueError('counts must be a trials x genotypes (2^drugs) array!')
+        self.maxBirthProb = maxBirthProb
+        self.clearProb = clearProb
+        self.mutProb = mutProb
+        self.maxPop = maxPop
+        self.rng = numpy.random if rng is None else rng
+        self.administeredDrugs = []
+        self.activeMask = 0
+        self.canReproduce = resistantGenotypes(self.counts.shape[1], 0)
+
+        # Trials whose virus population has not died out; extinct trials
+        # stay extinct, so update() leaves them alone
+        self.alive = numpy.flatnonzero(self.counts.sum(axis=1) > 0)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def knownMask(self, drugs):
+        """
+        returns: the genotype bitmask of the drugs in drugs the particles
+        carry traits for.
+        """
+        return self.registry.mask([drug for drug in drugs if drug in self.registry])
+
+    def addPrescription(self, newDrug):
+        """
+        Administer a drug to every patient of the batch.
+        """
+        if newDrug not in self.administeredDrugs:
+            self.administeredDrugs.append(newDrug)
+            self.activeMask |= self.knownMask([newDrug])
+            self.canReproduce = resistantGenotypes(self.counts.shape[1], self.activeMask)
+
+    def setActiveMask(self, activeMask):
+        """
+        Administer exactly the drugs whose bits are set in activeMask to
+        every patient of the batch, see GenotypePatient.setActiveMask().
+        """
+        drugs = self.registry.names(activeMask)
+        self.administeredDrugs = [drug for drug in self.administeredDrugs if drug in drugs] + \
+            [drug for drug in drugs if drug not in self.administeredDrugs]
+        self.activeMask = activeMask
+        self.canReproduce = resistantGenotypes(self.counts.shape[1], activeMask)
+
+    def setActiveMasks(self, activeMasks):
+        """
+        Gives every patient of the batch its own prescriptions, e.g. to run
+        several treatment schedules in one batch.
+
+        activeMasks: the knownMask() of the drugs administered to each
+        trial (an integer array with one entry per trial)
+
+        getPrescriptions() is not meaningful for such a batch.
+        """
+        self.activeMask = numpy.asarray(activeMasks, dtype=numpy.int64)
+        self.canReproduce = resistantGenotypes(self.counts.shape[1], self.activeMask[:, numpy.newaxis])
+
+    def getPrescriptions(self):
+        return self.administeredDrugs
+
+    def getTotalPop(self):
+        """
+        returns: The total virus population of each trial (an integer array)
+        """
+        return self.counts.sum(axis=1)
+
+    def getResistPop(self, drugResist):
+        """
+        returns: The population of viruses with resistances to all drugs in
+        the drugResist list, for each trial (an integer array)
+        """
+        if len(drugResist) == 0:
+            return numpy.zeros(len(self), dtype=numpy.int64)
+        resistant = resistantGenotypes(self.counts.shape[1], self.knownMask(drugResist))
+        return self.counts[:, resistant].sum(axis=1)
+
+    def fork(self, rng=None):
+        """
+        returns: a copy of the whole batch that evolves independently from
+        here on, see GenotypePatient.fork().
+        """
+        twin = copy.copy(self)
+        twin.counts = self.counts.copy()
+        twin.administeredDrugs = list(self.administeredDrugs)
+        twin.alive = self.alive.copy()
+        if rng is not None:
+            twin.rng = rng
+        return twin
+
+    def update(self):
+        """
+        Advance every trial by a single time step.
+
+        Only the trials in self.alive are simulated; the others have no
+        particles left.
+
+        returns: The total virus population of each trial at the end of the
+        update (an integer array)
+        """
+        if len(self.alive) == len(self.counts):
+            self.counts = stepCounts(self.counts, self.maxPop, self.maxBirthProb, self.clearProb,
+                                     self.mutProb, len(self.registry), self.canReproduce, self.rng)
+        elif len(self.alive):
+            canReproduce = self.canReproduce[self.alive] if self.canReproduce.ndim > 1 else self.canReproduce
+            self.counts[self.alive] = stepCounts(self.counts[self.alive], self.maxPop, self.maxBirthProb,
+                                                 self.clearProb, self.mutProb, len(self.registry), canReproduce,
+                                                 self.rng)
+        totalPop = self.getTotalPop()
+        self.alive = self.alive[totalPop[self.alive] > 0]
+        return totalPop
+
+
+def batchedPatients(numTrials, numViruses, maxBirthProb, clearProb, resistances, mutProb, maxPop, rng=None):
+    """
+    returns: BatchedPatients of numTrials patients that all start with
+    numViruses particles with the given resistances dictionary.
+    """
+    drugs = sorted(resistances)
+    counts = numpy.tile(initialCounts(numViruses, resistances, drugs), (numTrials, 1))
+    return BatchedPatients(counts, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng)
+
+
+def simulateTrials(numTrials, numTimeSteps, numViruses, maxBirthProb, clearProb, resistances,
+                   mutProb, maxPop, prescriptions, drugResist, rng=None):
+    """
+    Simulates numTrials patients in lockstep and records their trajectories
+    the way ps8S2.simulationWithDrug does: column 0 holds the initial
+    population, column t the population after the t-th update().
+
+    prescriptions: a virussim.schedule.TreatmentSchedule, or (time step,
+    drug name) pairs; the drug is added before the update of that time step
+
+    drugResist: drugs whose jointly resistant population is recorded
+
+    returns: a tuple (dataMatrixTotal, dataMatrixDrugResistant) of
+    numTrials x numTimeSteps float arrays
+    """
+    dataMatrixTotal, dataMatrixDrugResistant = simulateSchedules([prescriptions], numTrials, numTimeSteps,
+        numViruses, maxBirthProb, clearProb, resistances, mutProb, maxPop, drugResist, rng)
+    return dataMatrixTotal[0], dataMatrixDrugResistant[0]
+
+
+def simulateSchedules(schedules, numTrials, numTimeSteps, numViruses, maxBirthProb, clearProb, resistances,
+                      mutProb, maxPop, drugResist, rng=None):
+    """
+    Simulates numTrials patients under each of several treatment schedules,
+    all in one batch: the schedules are compiled to per-step drug masks and
+    every step is a single update of the whole batch.
+
+    schedules: virussim.schedule.TreatmentSchedule instances (or lists of
+    events)
+
+    returns: a tuple (dataMatrixTotal, dataMatrixDrugResistant) of
+    schedules x numTrials x numTimeSteps float arrays, laid out like those
+    of simulateTrials()
+    """
+    numSchedules = len(schedules)
+    patients = batchedPatients(numSchedules * numTrials, numViruses, maxBirthProb, clearProb, resistances,
+                               mutProb, maxPop, rng)
+
+    # One row of masks per trial: trials of a schedule are consecutive
+    masks = numpy.array([asSchedule(schedule).compile(numTimeSteps, patients.knownMask)
+                         for schedule in schedules])
+    masks = numpy.repeat(masks, numTrials, axis=0)
+    changes = set(maskChanges(masks))
+
+    dataMatrixTotal = numpy.zeros(shape=(numSchedules * numTrials, numTimeSteps))
+    dataMatrixDrugResistant = numpy.zeros(shape=(numSchedules * numTrials, numTimeSteps))
+    for time in range(numTimeSteps):
+        if len(patients.alive) == 0:
+            # Every trial died out: the remaining columns stay 0
+            break
+        if time == 0 or time in changes:
+            if numSchedules == 1:
+                patients.setActiveMask(int(masks[0, time]))
+            else:
+                patients.setActiveMasks(masks[:, time])
+        if time == 0:
+            dataMatrixTotal[:, 0] = patients.getTotalPop()
+        else:
+            dataMatrixTotal[:, time] = patients.update()
+        dataMatrixDrugResistant[:, time] = patients.getResistPop(drugResist)
+
+    shape = (numSchedules, numTrials, numTimeSteps)
+    return dataMatrixTotal.reshape(shape), dataMatrixDrugResistant.reshape(shape)
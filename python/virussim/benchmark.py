@@ -0,0 +1,256 @@
+"""
+Benchmarks of the patient update and census paths of every engine.
+
+    python -m virussim.benchmark [--quick] [--output results.json]
+
+times SimplePatient.update (object and array populations), Patient.update
+and Patient.getResistPop of every engine over a range of population sizes
+and numbers of drugs, and whole simulationWithDrug runs (the simulation
+part, without the plots) of every engine. Each case is repeated until it
+has run for at least minTime seconds, and is run in a fresh worker process
+so that its peak resident memory can be reported. The results are written
+as JSON: one record per case with steps/sec, particles/sec (virus
+particles updated or counted per second) and the peak memory in bytes.
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+import numpy
+
+import ps7_v1
+from virussim.model import resistantPatient
+from virussim.trials import simulateTrajectories
+
+# Default sweep
+POPULATIONS = [100, 1000, 10 ** 4, 10 ** 5, 10 ** 6]
+NUM_DRUGS = [1, 2, 4, 8, 16]
+ENGINES = ['particle', 'genotype', 'sparse', 'tauleap', 'gillespie']
+SIMULATION_ENGINES = ['particle', 'genotype', 'sparse', 'batched', 'tauleap', 'gillespie']
+
+# Largest population benchmarked per engine; beyond these a single step
+# takes minutes
+MAX_POPULATION = {'particle': 10 ** 5, 'simple': 10 ** 5, 'gillespie': 10 ** 4}
+
+# Virus parameters of the benchmarked patients (those of ps8S2)
+MAX_BIRTH_PROB = 0.1
+CLEAR_PROB = 0.05
+MUT_PROB = 0.005
+
+
+def peakMemory():
+    """
+    returns: the peak resident set size of this process in bytes
+    """
+    import resource
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxRss if sys.platform == 'darwin' else maxRss * 1024
+
+
+def drugNames(numDrugs):
+    return ['drug%d' % drug for drug in range(numDrugs)]
+
+
+def timeRepeatedly(step, minTime, maxRepeats):
+    """
+    Calls step() until minTime seconds have passed or it has been called
+    maxRepeats times.
+
+    returns: a tuple (repeats, seconds, work) where work is the sum of the
+    values returned by step() (e.g. the particles it processed)
+    """
+    repeats, work = 0, 0
+    start = time.time()
+    while True:
+        work += step()
+        repeats += 1
+        seconds = time.time() - start
+        if seconds >= minTime or repeats >= maxRepeats:
+            return repeats, seconds, work
+
+
+def benchSimplePatientUpdate(engine, population, minTime=0.5, maxSteps=1000):
+    """
+    Times SimplePatient.update ('simple') or ArraySimplePatient.update
+    ('array') near a steady population of the given size.
+    """
+    maxPop = 2 * population
+    if engine == 'simple':
+        patient = ps7_v1.SimplePatient(ps7_v1.virusCollection(population, MAX_BIRTH_PROB, CLEAR_PROB), maxPop)
+    else:
+        patient = ps7_v1.ArraySimplePatient(ps7_v1.virusPopulation(population, MAX_BIRTH_PROB, CLEAR_PROB), maxPop)
+
+    def step():
+        particles = patient.getTotalPop()
+        patient.update()
+        return particles
+
+    return timeRepeatedly(step, minTime, maxSteps)
+
+
+def benchPatient(engine, population, numDrugs):
+    """
+    returns: a patient of the engine near a steady population of the given
+    size, with viruses that can become resistant to numDrugs drugs (none of
+    which is prescribed)
+    """
+    resistances = dict((drug, False) for drug in drugNames(numDrugs))
+    return resistantPatient(engine, population, MAX_BIRTH_PROB, CLEAR_PROB, resistances, MUT_PROB,
+                                  2 * population, numpy.random.RandomState(0) if engine != 'particle' else None)
+
+
+def benchPatientUpdate(engine, population, numDrugs, minTime=0.5, maxSteps=1000):
+    """
+    Times Patient.update (or the update of the engine's patient).
+    """
+    patient = benchPatient(engine, population, numDrugs)
+
+    def step():
+        particles = patient.getTotalPop()
+        patient.update()
+        return particles
+
+    return timeRepeatedly(step, minTime, maxSteps)
+
+
+def benchGetResistPop(engine, population, numDrugs, minTime=0.5, maxCalls=10 ** 5):
+    """
+    Times getResistPop with all drugs of the panel.
+    """
+    patient = benchPatient(engine, population, numDrugs)
+    patient.update()
+    drugs = drugNames(numDrugs)
+
+    def step():
+        patient.getResistPop(drugs)
+        return patient.getTotalPop()
+
+    return timeRepeatedly(step, minTime, maxCalls)
+
+
+def benchSimulationWithDrug(engine, numTrials, minTime=0.5, maxRuns=100):
+    """
+    Times the trials of simulationWithDrug (150 + 150 time steps), i.e.
+    virussim.trials.simulateTrajectories; a step is one time step of one trial.
+    """
+    def step():
+        dataMatrixTotal = simulateTrajectories(numTrials, 150, 150, 'guttagonol', engine)[0]
+        return dataMatrixTotal.sum()
+
+    runs, seconds, particles = timeRepeatedly(step, minTime, maxRuns)
+    return runs * numTrials * 300, seconds, particles
+
+
+BENCHMARKS = {'SimplePatient.update': benchSimplePatientUpdate,
+              'Patient.update': benchPatientUpdate,
+              'Patient.getResistPop': benchGetResistPop,
+              'simulationWithDrug': benchSimulationWithDrug}
+
+
+def runCase(case):
+    """
+    Runs one benchmark case (a dict with the 'benchmark' name and the
+    arguments of its function).
+
+    returns: the case completed with its timings and peak memory
+    """
+    args = dict(case)
+    function = BENCHMARKS[args.pop('benchmark')]
+    steps, seconds, particles = function(**args)
+    result = dict(case)
+    result.update({'steps': int(steps), 'seconds': seconds, 'stepsPerSec': steps / seconds,
+                   'particlesPerSec': float(particles) / seconds, 'peakMemory': peakMemory()})
+    return result
+
+
+def benchmarkCases(populations=POPULATIONS, numDrugs=NUM_DRUGS, engines=ENGINES,
+                   simulationEngines=SIMULATION_ENGINES, numTrials=10, minTime=0.5):
+    """
+    returns: the cases (see runCase) of a full sweep
+    """
+    cases = []
+    for engine in ['simple', 'array']:
+        for population in populations:
+            if population <= MAX_POPULATION.get(engine, population):
+                cases.append({'benchmark': 'SimplePatient.update', 'engine': engine, 'population': population,
+                              'minTime': minTime})
+    for name in ['Patient.update', 'Patient.getResistPop']:
+        for engine in engines:
+            for population in populations:
+                if population > MAX_POPULATION.get(engine, population):
+                    continue
+                for drugs in numDrugs:
+                    cases.append({'benchmark': name, 'engine': engine, 'population': population,
+                                  'numDrugs': drugs, 'minTime': minTime})
+    for engine in simulationEngines:
+        cases.append({'benchmark': 'simulationWithDrug', 'engine': engine, 'numTrials': numTrials,
+                      'minTime': minTime})
+    return cases
+
+
+def runBenchmarks(cases, isolate=True, log=None):
+    """
+    Runs the cases, each in a fresh worker process if isolate is True (so
+    that peakMemory is the peak of that case alone, plus the interpreter).
+
+    log: a file the results are reported to as they finish, or None
+
+    returns: a dict with a description of the machine and the list of
+    results
+    """
+    results = []
+    for case in cases:
+        if isolate:
+            pool = multiprocessing.Pool(1)
+            try:
+                result = pool.apply(runCase, (case,))
+            finally:
+                pool.terminate()
+        else:
+            result = runCase(case)
+        results.append(result)
+        if log is not None:
+            log.write('%-22s %-10s pop=%-8s drugs=%-3s %12.1f steps/s %14.1f particles/s\n' % (
+                result['benchmark'], result['engine'], result.get('population', '-'),
+                result.get('numDrugs', '-'), result['stepsPerSec'], result['particlesPerSec']))
+    machine = {'platform': platform.platform(), 'processor': platform.processor(),
+               'python': platform.python_version(), 'numpy': numpy.__version__,
+               'cpus': multiprocessing.cpu_count()}
+    return {'machine': machine, 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the virus population simulations.')
+    parser.add_argument('--populations', type=int, nargs='+', default=POPULATIONS)
+    parser.add_argument('--drugs', type=int, nargs='+', default=NUM_DRUGS)
+    parser.add_argument('--engines', nargs='+', default=ENGINES)
+    parser.add_argument('--simulation-engines', nargs='+', default=SIMULATION_ENGINES)
+    parser.add_argument('--trials', type=int, default=10, help='trials per simulationWithDrug run')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds each case runs for')
+    parser.add_argument('--quick', action='store_true', help='populations up to 10^4, 1 and 4 drugs')
+    parser.add_argument('--no-isolate', action='store_true', help='run every case in this process')
+    parser.add_argument('--output', help='JSON file for the results (default: standard output)')
+    args = parser.parse_args(argv)
+
+    populations, numDrugs = args.populations, args.drugs
+    if args.quick:
+        populations = [population for population in populations if population <= 10 ** 4]
+        numDrugs = [drugs for drugs in numDrugs if drugs in (1, 4)]
+    cases = benchmarkCases(populations, numDrugs, args.engines, args.simulation_engines, args.trials,
+                           args.min_time)
+    report = runBenchmarks(cases, not args.no_isolate, sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Content-addressed on-disk cache of simulation results.
+
+Results are stored as .npz files named after a hash of every parameter that
+determines them (virus parameters, schedule, trial count, engine, seed), so
+rerunning a simulation with the same parameters, e.g. to regenerate the
+PNGs in plots/, loads the arrays instead of simulating again. The total
+size of the cache is bounded; when it grows beyond maxBytes the least
+recently used entries are evicted.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy
+
+# Bump when the simulations change in a way that invalidates stored results
+CACHE_VERSION = 3
+
+
+def cacheKey(params):
+    """
+    returns: the hex digest identifying a set of parameters (a dict of
+    JSON-serializable values; tuples are treated like lists).
+    """
+    text = json.dumps({'version': CACHE_VERSION, 'params': params}, sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Directory of cached results with least-recently-used eviction.
+    """
+
+    def __init__(self, directory, maxBytes=2 ** 30):
+        """
+        directory: where the results are stored (created if missing)
+
+        maxBytes: upper bound of the total size of the stored results (an
+        integer)
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, params):
+        return os.path.join(self.directory, cacheKey(params) + '.npz')
+
+    def get(self, params):
+        """
+        returns: the arrays stored for params (a dict of name -> array), or
+        None if they are not in the cache
+        """
+        path = self.path(params)
+        try:
+            with open(path, 'rb') as f:
+                stored = numpy.load(f)
+                arrays = dict((name, stored[name]) for name in stored.files)
+        except (IOError, OSError):
+            return None
+        # The modification time records the last use, for eviction
+        os.utime(path, None)
+        return arrays
+
+    def put(self, params, arrays):
+        """
+        Stores arrays (a dict of name -> array) for params, then evicts
+        least recently used results until the cache fits in maxBytes.
+        """
+        handle, temporary = tempfile.mkstemp(suffix='.npz', dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                numpy.savez_compressed(f, **arrays)
+            os.rename(temporary, self.path(params))
+        except Exception:
+            os.remove(temporary)
+            raise
+        self.evict()
+
+    def entries(self):
+        """
+        returns: (last use, size, path) of every stored result, least
+        recently used first
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz') and not name.startswith('tmp'):
+                path = os.path.join(self.directory, name)
+                info = os.stat(path)
+                entries.append((info.st_mtime, info.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
@@ -0,0 +1,173 @@
+"""
+SQLite catalog of the simulation runs that have been made.
+
+Every run of simulationWithDrug, simulationDelayedTreatment, the
+delayed-treatment sweep of ps8S2 or problem6 of ps8_345 can be recorded
+with its parameters, seed, engine, wall time and summary statistics, so
+finding out what has already been simulated (and what came out of it) is a
+query instead of a rerun. Records are buffered and inserted in batches, one
+transaction per batch, and the parameters that sweeps vary are indexed.
+"""
+
+import json
+import sqlite3
+import time
+
+import numpy
+
+# Number of records buffered before they are written in one transaction
+BATCH_SIZE = 100
+
+# Final total population at or below which a patient counts as cured
+CURED_POPULATION = 50
+
+COLUMNS = ['createdAt', 'kind', 'engine', 'seed', 'numTrials', 'numTimeSteps', 'maxPop', 'numViruses',
+           'maxBirthProb', 'clearProb', 'mutProb', 'delay', 'lag', 'drugs', 'params', 'wallTime',
+           'curedPercentage', 'meanFinalPop', 'resistantFraction']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    createdAt REAL,
+    kind TEXT,
+    engine TEXT,
+    seed INTEGER,
+    numTrials INTEGER,
+    numTimeSteps INTEGER,
+    maxPop INTEGER,
+    numViruses INTEGER,
+    maxBirthProb REAL,
+    clearProb REAL,
+    mutProb REAL,
+    delay INTEGER,
+    lag INTEGER,
+    drugs TEXT,
+    params TEXT,
+    wallTime REAL,
+    curedPercentage REAL,
+    meanFinalPop REAL,
+    resistantFraction REAL
+);
+CREATE INDEX IF NOT EXISTS runsByMutProb ON runs (mutProb, delay);
+CREATE INDEX IF NOT EXISTS runsByDelay ON runs (delay, lag);
+CREATE INDEX IF NOT EXISTS runsByVirus ON runs (maxBirthProb, clearProb, mutProb);
+CREATE INDEX IF NOT EXISTS runsByEngine ON runs (engine, numTrials);
+"""
+
+
+def runSummary(finalTotalPopulations, finalResistantPopulations):
+    """
+    returns: a dict with the cured percentage, mean final total population
+    and the fraction of the final population that is drug resistant
+    """
+    finalTotal = numpy.asarray(finalTotalPopulations, dtype=float)
+    finalResistant = numpy.asarray(finalResistantPopulations, dtype=float)
+    if len(finalTotal) == 0:
+        return {'curedPercentage': None, 'meanFinalPop': None, 'resistantFraction': None}
+    totalPop = finalTotal.sum()
+    return {'curedPercentage': 100 * numpy.mean(finalTotal <= CURED_POPULATION),
+            'meanFinalPop': finalTotal.mean(),
+            'resistantFraction': finalResistant.sum() / totalPop if totalPop else 0.0}
+
+
+def runRecord(kind, params, wallTime, finalTotalPopulations, finalResistantPopulations):
+    """
+    returns: the catalog record (a dict) of one run
+
+    kind: what produced the run, e.g. 'simulationWithDrug'
+
+    params: the run parameters as returned by
+    virussim.trials.cacheParameters(); its schedule gives the delay (time
+    steps before the first drug) and, with two drugs, the lag between them
+    """
+    schedule = params['schedule']
+    record = {'createdAt': time.time(), 'kind': kind, 'engine': params['engine'], 'seed': params['seed'],
+              'numTrials': params['numTrials'], 'numTimeSteps': params['numTimeSteps'],
+              'maxPop': params['maxPop'], 'numViruses': params['numViruses'],
+              'maxBirthProb': params['maxBirthProb'], 'clearProb': params['clearProb'],
+              'mutProb': params['mutProb'], 'delay': schedule[0][0] if schedule else None,
+              'lag': schedule[1][0] - schedule[0][0] if len(schedule) > 1 else None,
+              'drugs': json.dumps([drug for step, drug in schedule]),
+              'params': json.dumps(params, sort_keys=True), 'wallTime': wallTime}
+    record.update(runSummary(finalTotalPopulations, finalResistantPopulations))
+    return record
+
+
+class RunCatalog(object):
+    """
+    A SQLite database with one row per recorded run.
+    """
+
+    def __init__(self, path='simulation_runs.sqlite', batchSize=BATCH_SIZE):
+        """
+        path: the database file (created if missing; ':memory:' keeps it
+        in memory)
+
+        batchSize: number of records buffered before they are inserted
+        """
+        self.path = path
+        self.batchSize = batchSize
+        self.pending = []
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    def record(self, record):
+        """
+        Adds a run (a dict as returned by runRecord). Records are written
+        when batchSize of them are pending, on flush() and on close().
+        """
+        self.pending.append(tuple(record.get(column) for column in COLUMNS))
+        if len(self.pending) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        """
+        Inserts the pending records in a single transaction.
+        """
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT INTO runs (%s) VALUES (%s)' % (', '.join(COLUMNS), \
+                ', '.join('?' * len(COLUMNS))), self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def runs(self, where=None, args=(), orderBy='id'):
+        """
+        returns: the recorded runs matching an SQL condition on the columns,
+        as a list of dicts, e.g.
+
+            catalog.runs('mutProb = ? AND delay <= ?', (0.005, 150))
+        """
+        self.flush()
+        query = 'SELECT * FROM runs'
+        if where:
+            query += ' WHERE ' + where
+        query += ' ORDER BY ' + orderBy
+        return [dict(row) for row in self.connection.execute(query, args)]
+
+    def find(self, **equalities):
+        """
+        returns: the recorded runs whose columns have the given values, e.g.
+        catalog.find(engine='batched', numTrials=500)
+        """
+        columns = sorted(equalities)
+        for column in columns:
+            if column not in COLUMNS and column != 'id':
+                raise ValueError('unknown column %s' % column)
+        where = ' AND '.join('%s = ?' % column for column in columns)
+        return self.runs(where, tuple(equalities[column] for column in columns))
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
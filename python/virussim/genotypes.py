@@ -0,0 +1,224 @@
+"""
+Genotype-count engine for the drug resistance model of ps8S2.
+
+All virus particles that share a genotype and parameters are statistically
+identical, so instead of one ResistantVirus object per particle the engine
+keeps one count per genotype. Genotype g is the bitmask of the drugs (in
+registry order) a particle is resistant to, so a population over k drugs is
+an integer array of 2^k counts and a time step costs O(k * 2^k) draws no
+matter how large the population is.
+"""
+
+import copy
+
+import numpy
+
+from virussim.model import DrugRegistry, DRUG_REGISTRY
+
+
+def resistantGenotypes(numGenotypes, drugMask):
+    """
+    returns: a boolean array over genotypes 0..numGenotypes-1 that is True
+    for the genotypes resistant to every drug in drugMask (an integer).
+    """
+    genotypes = numpy.arange(numGenotypes)
+    return (genotypes & drugMask) == drugMask
+
+
+def mutateCounts(counts, numDrugs, mutProb, rng=numpy.random):
+    """
+    Applies mutation to newborn particles given as counts per genotype.
+    Every resistance trait of every particle flips independently with
+    probability mutProb, which is drawn as one binomial per genotype and
+    trait: the particles of genotype g flipping trait b move to g ^ (1 << b).
+
+    counts: newborn counts per genotype (an integer array whose last axis
+    has 2^numDrugs entries; leading axes, e.g. trials, are kept)
+
+    returns: the counts per genotype after mutation (an integer array of
+    the same shape)
+    """
+    genotypes = numpy.arange(counts.shape[-1])
+    for bit in range(numDrugs):
+        flips = rng.binomial(counts, mutProb)
+        counts = counts - flips + flips[..., genotypes ^ (1 << bit)]
+    return counts
+
+
+def stepCounts(counts, maxPop, maxBirthProb, clearProb, mutProb, numDrugs,
+               canReproduce, rng=numpy.random):
+    """
+    Advances genotype counts by a single time step, in the order used by
+    Patient.update(): clearance, population density, reproduction (only for
+    genotypes resistant to all administered drugs) and mutation of the
+    offspring.
+
+    counts: counts per genotype (an integer array; a leading axis holds
+    independent patients)
+
+    canReproduce: boolean array over genotypes, see resistantGenotypes()
+
+    returns: the counts per genotype at the end of the step
+    """
+    survivors = counts - rng.binomial(counts, clearProb)
+
+    popDensity = survivors.sum(axis=-1) / float(maxPop)
+    birthProb = numpy.clip(maxBirthProb * (1 - popDensity), 0, 1)
+    if survivors.ndim > 1:
+        birthProb = birthProb[..., numpy.newaxis]
+
+    births = rng.binomial(survivors * canReproduce, birthProb)
+    return survivors + mutateCounts(births, numDrugs, mutProb, rng)
+
+
+class GenotypePatient(object):
+    """
+    Patient whose virus population is a count per genotype instead of a
+    list of ResistantVirus particles. Offers the same methods as
+    ps8S2.Patient, so it can be used wherever a Patient is simulated.
+    """
+
+    def __init__(self, counts, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng=None):
+        """
+        Initialization function.
+
+        counts: number of particles per genotype (a sequence of 2^len(drugs)
+        integers; bit i of a genotype is resistance to drugs[i])
+
+        drugs: the drugs the particles carry resistance traits for (a list
+        of strings)
+
+        maxBirthProb, clearProb, mutProb: virus parameters shared by all
+        particles, as in ResistantVirus
+
+        maxPop: The  maximum virus population for this patient (an integer)
+
+        rng: random number generator with the numpy.random interface
+        (defaults to the numpy.random module)
+        """
+        self.registry = DrugRegistry(drugs)
+        self.counts = numpy.asarray(counts, dtype=numpy.int64)
+        if self.counts.shape != (2 ** len(self.registry),):
+            raise ValueError('counts must hold one entry per genotype (2^drugs)!')
+        self.maxBirthProb = maxBirthProb
+        self.clearProb = clearProb
+        self.mutProb = mutProb
+        self.maxPop = maxPop
+        self.rng = numpy.random if rng is None else rng
+        self.administeredDrugs = []
+        self.activeMask = 0
+        self.canReproduce = resistantGenotypes(len(self.counts), 0)
+
+    def knownMask(self, drugs):
+        """
+        returns: the genotype bitmask of the drugs in drugs the particles
+        carry traits for. Other drugs are resisted by every particle, so
+        they are left out.
+        """
+        return self.registry.mask([drug for drug in drugs if drug in self.registry])
+
+    def addPrescription(self, newDrug):
+        """
+        Administer a drug to this patient, as in Patient.addPrescription().
+        """
+        if newDrug not in self.administeredDrugs:
+            self.administeredDrugs.append(newDrug)
+            self.activeMask |= self.knownMask([newDrug])
+            self.canReproduce = resistantGenotypes(len(self.counts), self.activeMask)
+
+    def setActiveMask(self, activeMask):
+        """
+        Administer exactly the drugs whose bits are set in activeMask, as in
+        Patient.setActiveMask(); the mask is built with knownMask(), e.g. by
+        TreatmentSchedule.compile(numTimeSteps, patient.knownMask).
+        """
+        drugs = self.registry.names(activeMask)
+        self.administeredDrugs = [drug for drug in self.administeredDrugs if drug in drugs] + \
+            [drug for drug in drugs if drug not in self.administeredDrugs]
+        self.activeMask = activeMask
+        self.canReproduce = resistantGenotypes(len(self.counts), activeMask)
+
+    def getPrescriptions(self):
+        """
+        returns: The list of drug names (strings) being administered to this patient.
+        """
+        return self.administeredDrugs
+
+    def getTotalPop(self):
+        """
+        returns: The total virus population (an integer)
+        """
+        return int(self.counts.sum())
+
+    def getResistPop(self, drugResist):
+        """
+        returns: The population of viruses (an integer) with resistances to
+        all drugs in the drugResist list.
+        """
+        if len(drugResist) == 0:
+            return 0
+        resistant = resistantGenotypes(len(self.counts), self.knownMask(drugResist))
+        return int(self.counts[resistant].sum())
+
+    def fork(self, rng=None):
+        """
+        Snapshot of this patient that evolves independently from here on.
+        Copying the counts costs O(2^drugs) whatever the population size.
+
+        rng: random number generator of the copy (shared with this patient
+        if None, in which case the two draw from one stream)
+
+        returns: a copy of this patient
+        """
+        twin = copy.copy(self)
+        twin.counts = self.counts.copy()
+        twin.administeredDrugs = list(self.administeredDrugs)
+        if rng is not None:
+            twin.rng = rng
+        return twin
+
+    def update(self):
+        """
+        Update the state of the virus population in this patient for a single
+        time step, drawing clearance, birth and mutation counts per genotype.
+
+        returns: The total virus population at the end of the update (an integer)
+        """
+        self.counts = stepCounts(self.counts, self.maxPop, self.maxBirthProb, self.clearProb,
+                                 self.mutProb, len(self.registry), self.canReproduce, self.rng)
+        return self.getTotalPop()
+
+
+def initialCounts(numViruses, resistances, drugs):
+    """
+    returns: genotype counts (an integer array) of numViruses particles that
+    all have the given resistances dictionary, with bits ordered as drugs.
+    """
+    counts = numpy.zeros(2 ** len(drugs), dtype=numpy.int64)
+    counts[DrugRegistry(drugs).mask([drug for drug in drugs if resistances[drug]])] = numViruses
+    return counts
+
+
+def genotypePatient(viruses, maxPop, rng=None):
+    """
+    Collapses a list of ResistantVirus particles into a GenotypePatient.
+    All particles must share maxBirthProb, clearProb, mutProb and the drugs
+    they carry resistance traits for.
+    """
+    if len(viruses) == 0:
+        raise ValueError('viruses must contain at least one ResistantVirus!')
+    first = viruses[0]
+    for virus in viruses:
+        if (virus.maxBirthProb, virus.clearProb, virus.mutProb, virus.traitMask) != \
+           (first.maxBirthProb, first.clearProb, first.mutProb, first.traitMask):
+            raise ValueError('all viruses must share their parameters and resistance traits!')
+
+    drugs = DRUG_REGISTRY.names(first.traitMask)
+    registry = DrugRegistry(drugs)
+    genotypes = {}
+    counts = numpy.zeros(2 ** len(drugs), dtype=numpy.int64)
+    for virus in viruses:
+        if virus.genotype not in genotypes:
+            genotypes[virus.genotype] = registry.mask(DRUG_REGISTRY.names(virus.genotype))
+        counts[genotypes[virus.genotype]] += 1
+    return GenotypePatient(counts, drugs, first.maxBirthProb, first.clearProb, first.mutProb, maxPop, rng)
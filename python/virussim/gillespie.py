@@ -0,0 +1,104 @@
+"""
+Continuous-time analog (Gillespie direct method) of the genotype-count
+model of virussim.genotypes.
+
+The per-step probabilities of the discrete model are turned into
+per-particle event rates that reproduce its expected dynamics over one
+time step: every particle is cleared at rate -log(1 - clearProb), so it
+survives a unit of time with probability 1 - clearProb, and every particle
+resistant to all administered drugs gives birth at rate
+log(1 + maxBirthProb * (1 - popDensity)), where popDensity is the density
+expected after clearance, so the resistant population grows by the same
+factor per unit of time as in a discrete step. Offspring flip each
+resistance trait with probability mutProb, as in
+ResistantVirus.reproduce(). The cost of a unit of simulated time is
+proportional to the number of events in it, so small populations close to
+extinction are cheap to simulate.
+
+The events are simulated exactly, but the process is not the discrete
+model: within a unit of time offspring can reproduce or be cleared in turn
+and the density changes with every event, so the fluctuations around the
+mean, and with them extinction and cure statistics, are not those of the
+particle, genotype and tau-leaping engines. With the default parameters of
+ps8S2 the means and cure rates agree within the sampling error of a few
+hundred trials, but no closer agreement is guaranteed. Use it as a
+continuous-time variant of the model, not to validate the other engines.
+"""
+
+import numpy
+
+from virussim.genotypes import GenotypePatient
+
+
+class GillespiePatient(GenotypePatient):
+    """
+    GenotypePatient whose update() simulates the events of one unit of
+    continuous time, so the populations it returns are samples of the
+    continuous-time analog of the model (see above) on the integer time
+    grid recorded by ps8S2.simulationWithDrug.
+    """
+
+    def __init__(self, counts, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng=None):
+        GenotypePatient.__init__(self, counts, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng)
+        # Per-particle clearance rate with the survival probability of a step
+        self.clearRate = -numpy.log1p(-clearProb) if clearProb < 1 else numpy.inf
+        self.time = 0.0
+        self.numEvents = 0
+
+    def mutate(self, genotype):
+        """
+        returns: the genotype of an offspring of a genotype particle (an
+        integer), with every resistance trait flipped with probability
+        mutProb.
+        """
+        flips = self.rng.random_sample(len(self.registry)) < self.mutProb
+        for bit in numpy.flatnonzero(flips):
+            genotype ^= 1 << int(bit)
+        return genotype
+
+    def advance(self, duration):
+        """
+        Simulates all clearance and birth events in the next duration units
+        of time with the direct method. Rates only change at events or
+        prescriptions, and the waiting time to the next event is memoryless,
+        so the event overshooting the end of the interval can be discarded.
+        """
+        endTime = self.time + duration
+        counts = self.counts
+        total = int(counts.sum())
+        while total > 0:
+            resistant = counts * self.canReproduce
+            numResistant = int(resistant.sum())
+            popDensity = total * (1 - self.clearProb) / float(self.maxPop)
+            birthRate = numpy.log1p(max(self.maxBirthProb * (1 - popDensity), 0)) * numResistant
+            clearRate = self.clearRate * total
+            totalRate = birthRate + clearRate
+            if totalRate <= 0:
+                break
+
+            self.time += self.rng.exponential(1.0 / totalRate)
+            if self.time >= endTime:
+                break
+
+            if self.rng.random_sample() * totalRate < clearRate:
+                # Clearance of a particle picked uniformly from the population
+                genotype = numpy.searchsorted(numpy.cumsum(counts), self.rng.random_sample() * total, 'right')
+                counts[genotype] -= 1
+                total -= 1
+            else:
+                # Birth from a parent picked uniformly among the resistant particles
+                parent = numpy.searchsorted(numpy.cumsum(resistant), self.rng.random_sample() * numResistant, 'right')
+                counts[self.mutate(int(parent))] += 1
+                total += 1
+            self.numEvents += 1
+
+        self.time = endTime
+
+    def update(self):
+        """
+        Simulate one unit of continuous time.
+
+        returns: The total virus population at the end of the update (an integer)
+        """
+        self.advance(1)
+        return self.getTotalPop()
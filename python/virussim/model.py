@@ -0,0 +1,135 @@
+"""
+The drug resistance model of ps8S2 shared by the simulation engines: the
+registry of drug bits, the default patient and virus characteristics and
+resistantPatient(), which creates a patient for any engine.
+
+ps8S2 and the engines of this package import these from here rather than
+from the ps8S2 script.
+"""
+
+import numpy
+
+
+class DrugRegistry(object):
+    """
+    Maps drug names to bit positions, so that a set of drugs (a particle's
+    resistances, or the drugs administered to a patient) can be stored as a
+    single integer bitmask.
+    """
+    def __init__(self, drugs=()):
+        """
+        Initialize a DrugRegistry, registering the given drugs in order.
+
+        drugs: drug names (strings) to register up front
+        """
+        self.drugs = []
+        self.bits = {}
+        for drug in drugs:
+            self.register(drug)
+
+    def __len__(self):
+        return len(self.drugs)
+
+    def __contains__(self, drug):
+        return drug in self.bits
+
+    def register(self, drug):
+        """
+        Register a drug if it is not known yet.
+
+        drug: The drug (a string)
+
+        returns: The bit position of the drug (an integer)
+        """
+        if drug not in self.bits:
+            self.bits[drug] = len(self.drugs)
+            self.drugs.append(drug)
+        return self.bits[drug]
+
+    def mask(self, drugs):
+        """
+        Build the bitmask of a collection of drugs, registering any drug that
+        is not known yet.
+
+        drugs: drug names (an iterable of strings)
+
+        returns: The bitmask with the bit of every drug in drugs set (an integer)
+        """
+        mask = 0
+        for drug in drugs:
+            mask |= 1 << self.register(drug)
+        return mask
+
+    def names(self, mask):
+        """
+        returns: The names of the drugs whose bits are set in mask, in bit
+        order (a list of strings)
+        """
+        return [drug for drug in self.drugs if mask >> self.bits[drug] & 1]
+
+
+# Registry shared by all ResistantVirus particles and Patients.
+DRUG_REGISTRY = DrugRegistry()
+
+
+# Number of drugs from which particle patients mutate their offspring with
+# the vectorized kernel of virussim.mutation
+MUTATION_KERNEL_DRUGS = 8
+
+
+def resistantPatient(engine, numViruses, maxBirthProb, clearProb, resistances, mutProb, maxPop, rng=None):
+    """
+    Creates a patient with numViruses identical ResistantVirus particles,
+    simulated by the given engine:
+
+    'particle': a ps8S2.Patient holding one ResistantVirus object per
+    particle (ps8S2 is imported when the first one is created)
+    'genotype': a virussim.genotypes.GenotypePatient holding one count per genotype
+    'gillespie': a virussim.gillespie.GillespiePatient simulating a
+    continuous-time analog of the genotype counts (same expected dynamics,
+    different fluctuations and cure statistics)
+    'tauleap': a virussim.tauleap.TauLeapPatient advancing the genotype counts
+    several time steps per draw
+    'sparse': a virussim.sparse.SparseGenotypePatient holding counts of the
+    genotypes present only, for panels of up to 63 drugs
+
+    rng: the random number generator of the patient, a random.Random for
+    'particle' and a numpy.random.RandomState for the other engines
+    """
+    if engine == 'particle':
+        from ps8S2 import Patient, resistantVirusCollection
+        viruses = resistantVirusCollection(numViruses, maxBirthProb, clearProb, resistances, mutProb)
+        patient = Patient(viruses, maxPop, rng)
+        # With many drugs, mutate the offspring in batches, drawing from a
+        # stream seeded from the patient's
+        if len(resistances) >= MUTATION_KERNEL_DRUGS and not DRUG_REGISTRY.mask(resistances) >> 63:
+            patient.mutationRng = numpy.random.RandomState(patient.rng.getrandbits(32))
+        return patient
+    if engine in ('genotype', 'gillespie', 'tauleap'):
+        from virussim.genotypes import GenotypePatient, initialCounts
+        from virussim.gillespie import GillespiePatient
+        from virussim.tauleap import TauLeapPatient
+        drugs = sorted(resistances)
+        counts = initialCounts(numViruses, resistances, drugs)
+        patientClass = {'genotype': GenotypePatient, 'gillespie': GillespiePatient,
+                        'tauleap': TauLeapPatient}[engine]
+        return patientClass(counts, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng)
+    if engine == 'sparse':
+        from virussim.sparse import SparseGenotypePatient, initialPopulation
+        drugs = sorted(resistances)
+        population = initialPopulation(numViruses, resistances, drugs)
+        return SparseGenotypePatient(population, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng)
+    raise ValueError('unknown engine: ' + str(engine))
+
+
+def simulationParameters():
+    """
+    Returns the patient and virus characteristics shared by the simulations
+    of ps8S2 (a dict)
+    """
+    return {'maxPop': 1000, # maximum sustainable virus population
+            'numViruses': 100, # initial number of viruses
+            'maxBirthProb': 0.1,
+            'clearProb': 0.05,
+            'resistances': {'guttagonol': False},
+            'mutProb': 0.005}
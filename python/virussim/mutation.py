@@ -0,0 +1,121 @@
+"""
+Vectorized mutation of newborn genotype bitmasks.
+
+ResistantVirus.reproduce() flips every resistance trait of a child with
+probability mutProb, one random() draw per trait and child. The functions
+here draw the flip masks of a whole batch of children at once and apply
+them with XOR, keeping every trait flip an independent Bernoulli(mutProb)
+event:
+
+- for small mutProb (the usual case) the positions of the flipped bits in
+  the children x traits bit matrix are found by skipping geometric gaps
+  between them, so the cost is proportional to the number of flips
+  (about children * traits * mutProb draws) rather than to the number of
+  bits;
+- for large mutProb every trait gets a bit-plane of uniform draws.
+
+mutantFlipMasks() draws the masks of children already known to carry at
+least one flip, as the sparse engine of virussim.sparse needs.
+
+Masks are int64 arrays, so traits must use bits 0-62 (as in
+virussim.schedule).
+"""
+
+import numpy
+
+# Below this mutProb flip positions are drawn by geometric skips,
+# above it as Bernoulli bit-planes
+SPARSE_MUT_PROB = 0.1
+
+# Highest bit a trait may use in an int64 mask
+MAX_BIT = 62
+
+
+def traitWeights(traitMask):
+    """
+    returns: the int64 values of the bits set in traitMask (an integer),
+    lowest first
+    """
+    if traitMask < 0 or traitMask >> (MAX_BIT + 1):
+        raise ValueError('trait masks must fit in bits 0-%d' % MAX_BIT)
+    return numpy.array([1 << bit for bit in range(MAX_BIT + 1) if traitMask >> bit & 1], dtype=numpy.int64)
+
+
+def bitPlaneFlipMasks(numChildren, weights, mutProb, rng=numpy.random):
+    """
+    returns: flip masks (an int64 array of numChildren entries) with each
+    of the given trait bits set with probability mutProb, drawn as one
+    uniform per child and trait
+    """
+    planes = rng.random_sample((numChildren, len(weights))) < mutProb
+    return planes.astype(numpy.int64).dot(weights)
+
+
+def skipFlipMasks(numChildren, weights, mutProb, rng=numpy.random):
+    """
+    returns: flip masks as bitPlaneFlipMasks(), drawn by skipping from one
+    flipped bit of the children x traits bit matrix to the next with
+    geometric gaps, which is exactly the sequence of Bernoulli(mutProb)
+    trials read in row-major order
+    """
+    numTraits = len(weights)
+    numBits = numChildren * numTraits
+    flips = numpy.zeros(numChildren, dtype=numpy.int64)
+    expected = numBits * mutProb
+    batch = int(expected + 5 * numpy.sqrt(expected)) + 16
+    position = -1
+    while True:
+        positions = position + numpy.cumsum(rng.geometric(mutProb, batch))
+        hits = positions[positions < numBits]
+        numpy.bitwise_or.at(flips, hits // numTraits, weights[hits % numTraits])
+        if positions[-1] >= numBits:
+            return flips
+        position = positions[-1]
+
+
+def flipMasks(numChildren, traitMask, mutProb, rng=numpy.random):
+    """
+    returns: the flip masks of numChildren children (an int64 array), each
+    bit of traitMask (an integer) set independently with probability
+    mutProb
+    """
+    weights = traitWeights(traitMask)
+    if numChildren == 0 or len(weights) == 0 or mutProb <= 0:
+        return numpy.zeros(numChildren, dtype=numpy.int64)
+    if mutProb >= 1:
+        return numpy.full(numChildren, traitMask, dtype=numpy.int64)
+    if mutProb < SPARSE_MUT_PROB:
+        return skipFlipMasks(numChildren, weights, mutProb, rng)
+    return bitPlaneFlipMasks(numChildren, weights, mutProb, rng)
+
+
+def mutantFlipMasks(numChildren, traitMask, mutProb, rng=numpy.random):
+    """
+    returns: flip masks as flipMasks(), conditioned on at least one bit
+    being set (e.g. for children already known to be mutants). The lowest
+    flipped trait is drawn from its truncated geometric distribution, and
+    the traits above it flip independently with probability mutProb.
+    """
+    weights = traitWeights(traitMask)
+    if numChildren == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    if len(weights) == 0 or mutProb <= 0:
+        raise ValueError('children cannot mutate without traits or mutation probability')
+    if mutProb >= 1:
+        return numpy.full(numChildren, traitMask, dtype=numpy.int64)
+    anyFlip = 1 - (1 - mutProb) ** len(weights)
+    first = numpy.floor(numpy.log1p(-rng.random_sample(numChildren) * anyFlip) / numpy.log1p(-mutProb))
+    first = numpy.minimum(first.astype(numpy.int64), len(weights) - 1)
+    firstBits = weights[first]
+    higherBits = ~(firstBits | (firstBits - 1))
+    return firstBits | (flipMasks(numChildren, traitMask, mutProb, rng) & higherBits)
+
+
+def mutateGenotypes(genotypes, traitMask, mutProb, rng=numpy.random):
+    """
+    returns: the genotypes of the children of parents with the given
+    genotypes (an int64 array), every trait in traitMask flipped with
+    probability mutProb
+    """
+    genotypes = numpy.asarray(genotypes, dtype=numpy.int64)
+    return genotypes ^ flipMasks(len(genotypes), traitMask, mutProb, rng)
@@ -0,0 +1,116 @@
+"""
+Per-phase profiles of SimplePatient.update and Patient.update.
+
+Profiling is off by default: a patient's profile attribute is None and
+update() pays one check for it at every phase boundary. Setting it to an
+UpdateProfile makes the same update() add the time spent in every phase
+(startStep() and lap()) and count the random draws, the virus objects
+allocated and the particles processed. Profiling draws no random numbers,
+so trajectories do not change.
+
+    patient.profile = UpdateProfile()
+
+One profile per patient gives per-trial figures; merging them gives the
+figures of a sweep (see sweepProfile and
+virussim.trials.simulateTrajectories).
+"""
+
+import numpy
+from timeit import default_timer
+
+# Phases of an update, in the order they run
+PHASES = ('clearance', 'census', 'density', 'reproduction', 'mutation')
+
+
+class UpdateProfile(object):
+    """
+    Time per phase and work counters accumulated over update() calls.
+    """
+
+    def __init__(self):
+        self.steps = 0
+        self.seconds = dict((phase, 0.0) for phase in PHASES)
+        self.rngDraws = 0
+        self.objectsAllocated = 0
+        self.particlesProcessed = 0
+        self.lapStart = None
+
+    def startStep(self, particles):
+        """
+        Starts timing an update of a population of the given number of
+        particles.
+        """
+        self.steps += 1
+        self.particlesProcessed += particles
+        self.lapStart = default_timer()
+
+    def lap(self, phase):
+        """
+        Adds the time since the start of the step or the previous lap to
+        phase.
+        """
+        now = default_timer()
+        self.seconds[phase] += now - self.lapStart
+        self.lapStart = now
+
+    def totalSeconds(self):
+        return sum(self.seconds.values())
+
+    def merge(self, other):
+        """
+        Adds the figures of another profile to this one.
+        """
+        self.steps += other.steps
+        for phase in PHASES:
+            self.seconds[phase] += other.seconds[phase]
+        self.rngDraws += other.rngDraws
+        self.objectsAllocated += other.objectsAllocated
+        self.particlesProcessed += other.particlesProcessed
+
+    def asDict(self):
+        """
+        returns: the figures as a JSON-serializable dict, including the
+        share of the time spent in every phase
+        """
+        total = self.totalSeconds()
+        return {'steps': self.steps, 'seconds': dict(self.seconds), 'totalSeconds': total,
+                'fractions': dict((phase, self.seconds[phase] / total if total else 0.0) for phase in PHASES),
+                'rngDraws': self.rngDraws, 'objectsAllocated': self.objectsAllocated,
+                'particlesProcessed': self.particlesProcessed}
+
+    def __repr__(self):
+        phases = ', '.join('%s=%.3gs' % (phase, self.seconds[phase]) for phase in PHASES)
+        return 'UpdateProfile(steps=%d, %s, rngDraws=%d, objectsAllocated=%d, particlesProcessed=%d)' % (
+            self.steps, phases, self.rngDraws, self.objectsAllocated, self.particlesProcessed)
+
+
+def sweepProfile(profiles):
+    """
+    returns: an UpdateProfile with the merged figures of a list of
+    (per-trial) profiles
+    """
+    total = UpdateProfile()
+    for profile in profiles:
+        total.merge(profile)
+    return total
+
+
+class CountingGenerator(object):
+    """
+    Wraps a generator with the numpy.random interface and counts the
+    numbers drawn from it (the size of every sample), e.g. for the
+    vectorized draws of virussim.mutation, whose number is random.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.draws = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.rng, name)
+
+        def draw(*args, **kwargs):
+            sample = method(*args, **kwargs)
+            self.draws += numpy.size(sample)
+            return sample
+        return draw
@@ -0,0 +1,207 @@
+"""
+Process-pool trial runner for the simulations of ps8S2.
+
+Trials are split into chunks that are simulated by worker processes with
+virussim.trials.simulateTrajectories. Workers send back compact int32
+trajectory arrays, which the parent merges into the float trajectory
+matrices that simulationWithDrug and simulationDelayedTreatment work with.
+
+Every trial draws from its own stream derived from the root seed and the
+trial number (virussim.streams), so results are bit-identical for any
+number of workers and chunk size. The batched engine draws a whole block
+of trials from one stream, so its work units are always blocks of
+virussim.trials.BATCHED_BLOCK_TRIALS trials, as simulated in a single
+process.
+"""
+
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+
+from virussim.trials import BATCHED_BLOCK_TRIALS, cacheParameters, simulateForkedTrajectories, \
+    simulateTrajectories
+
+# Default number of trials per work unit
+CHUNK_SIZE = 10
+
+
+def simulateChunk(workUnit):
+    """
+    Worker function: simulates one chunk of trials of one scenario.
+
+    workUnit: a tuple (key, start, numTrials, numTimeStepsBeforeDrug,
+    numTimeStepsAfterDrug, drug, engine, seed); start is the number of the
+    first trial of the chunk, and key and start are passed back to tell the
+    parent where the rows belong
+
+    returns: a list with one tuple (key, start, totalPop, resistPop) with
+    int32 arrays of numTrials x numTimeSteps populations
+    """
+    key, start, numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, seed = workUnit
+    dataMatrixTotal, dataMatrixDrugResistant = simulateTrajectories(numTrials, numTimeStepsBeforeDrug, \
+        numTimeStepsAfterDrug, drug, engine, seed, start)
+    return [(key, start, dataMatrixTotal.astype(numpy.int32), dataMatrixDrugResistant.astype(numpy.int32))]
+
+
+def simulateForkedChunk(workUnit):
+    """
+    Worker function: simulates one chunk of trials of several
+    delayed-treatment scenarios with
+    virussim.trials.simulateForkedTrajectories.
+
+    workUnit: a tuple (start, numTrials, delays, numTimeStepsAfterDrug,
+    drug, engine, seed)
+
+    returns: a list of tuples (delay, start, totalPop, resistPop), one per
+    delay, like simulateChunk
+    """
+    start, numTrials, delays, numTimeStepsAfterDrug, drug, engine, seed = workUnit
+    results = simulateForkedTrajectories(numTrials, delays, numTimeStepsAfterDrug, drug, engine, seed, start)
+    return [(delay, start, dataMatrixTotal.astype(numpy.int32), dataMatrixDrugResistant.astype(numpy.int32))
+            for delay, (dataMatrixTotal, dataMatrixDrugResistant) in results.items()]
+
+
+def runWorkUnits(workUnits, shapes, executor=None, maxWorkers=None, worker=simulateChunk):
+    """
+    Runs the worker function (simulateChunk or simulateForkedChunk) on
+    every work unit and merges the chunks.
+
+    shapes: the (numTrials, numTimeSteps) shape of the trajectory matrices
+    of every key
+
+    executor: an executor with the concurrent.futures interface to use; a
+    ProcessPoolExecutor with maxWorkers processes is created if it is None
+
+    returns: a dict mapping every key to a tuple (dataMatrixTotal,
+    dataMatrixDrugResistant) of float arrays
+    """
+    results = dict((key, (numpy.zeros(shape), numpy.zeros(shape))) for key, shape in shapes.items())
+
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = ProcessPoolExecutor(max_workers=maxWorkers)
+    try:
+        for chunks in executor.map(worker, workUnits):
+            for key, start, totalPop, resistPop in chunks:
+                dataMatrixTotal, dataMatrixDrugResistant = results[key]
+                dataMatrixTotal[start:start + len(totalPop)] = totalPop
+                dataMatrixDrugResistant[start:start + len(resistPop)] = resistPop
+    finally:
+        if ownExecutor:
+            executor.shutdown()
+    return results
+
+
+def workUnitTrials(engine, chunkSize):
+    """
+    returns: the number of trials per work unit (an integer): chunkSize,
+    or BATCHED_BLOCK_TRIALS for the batched engine, whose results depend
+    on how many trials are simulated together
+    """
+    if engine == 'batched':
+        return BATCHED_BLOCK_TRIALS
+    return chunkSize
+
+
+def scenarioWorkUnits(key, numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine,
+                      chunkSize, seed):
+    """
+    returns: the work units (see simulateChunk) covering numTrials trials
+    of one scenario.
+    """
+    chunkSize = workUnitTrials(engine, chunkSize)
+    return [(key, start, min(chunkSize, numTrials - start), numTimeStepsBeforeDrug, numTimeStepsAfterDrug,
+             drug, engine, seed) for start in range(0, numTrials, chunkSize)]
+
+
+def iterateTrials(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug='guttagonol',
+                  engine='particle', chunkSize=CHUNK_SIZE, seed=0, executor=None, maxWorkers=None):
+    """
+    Parallel version of virussim.trials.iterateTrajectories: yields the
+    (totalPop, resistPop) int32 arrays of one chunk of trials at a time, in
+    trial order, instead of merging them into numTrials x numTimeSteps
+    matrices.
+    """
+    workUnits = scenarioWorkUnits(None, numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug,
+                                  engine, chunkSize, seed)
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = ProcessPoolExecutor(max_workers=maxWorkers)
+    try:
+        for chunks in executor.map(simulateChunk, workUnits):
+            for key, start, totalPop, resistPop in chunks:
+                yield totalPop, resistPop
+    finally:
+        if ownExecutor:
+            executor.shutdown()
+
+
+def runTrials(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug='guttagonol',
+              engine='particle', chunkSize=CHUNK_SIZE, seed=0, executor=None, maxWorkers=None):
+    """
+    Parallel version of virussim.trials.simulateTrajectories.
+
+    chunkSize: number of trials simulated per work unit (an integer; see
+    workUnitTrials)
+
+    returns: a tuple (dataMatrixTotal, dataMatrixDrugResistant) of
+    numTrials x numTimeSteps arrays
+    """
+    workUnits = scenarioWorkUnits(None, numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug,
+                                  engine, chunkSize, seed)
+    shapes = {None: (numTrials, numTimeStepsBeforeDrug + numTimeStepsAfterDrug)}
+    return runWorkUnits(workUnits, shapes, executor, maxWorkers)[None]
+
+
+def runDelayedTreatmentSweep(delays, numTrials=10, numTimeStepsAfterDrug=150, drug='guttagonol',
+                             engine='particle', chunkSize=CHUNK_SIZE, seed=0, executor=None, maxWorkers=None,
+                             forked=False, cache=None):
+    """
+    Runs the trials of every delayed-treatment scenario (one per number of
+    time steps before the drug is added) over a single process pool.
+
+    delays: numbers of time steps before the drug is added (a list of
+    integers)
+
+    forked: if True, each trial simulates its drug-free phase once and
+    forks it at every delay (see
+    virussim.trials.simulateForkedTrajectories) instead of simulating every
+    scenario from step 0
+
+    cache: a virussim.cache.ResultCache; only the scenarios missing from
+    it are simulated, and those are stored in it
+
+    returns: a dict mapping every delay to a tuple (dataMatrixTotal,
+    dataMatrixDrugResistant) of numTrials x numTimeSteps arrays
+    """
+    results = {}
+    params = dict((delay, cacheParameters(numTrials, delay, numTimeStepsAfterDrug, drug, engine, seed,
+                                                forked)) for delay in delays)
+    if cache is not None:
+        for delay in delays:
+            cached = cache.get(params[delay])
+            if cached is not None:
+                results[delay] = (cached['total'].astype(float), cached['resistant'].astype(float))
+
+    missing = [delay for delay in delays if delay not in results]
+    shapes = dict((delay, (numTrials, delay + numTimeStepsAfterDrug)) for delay in missing)
+
+    if forked and missing:
+        chunkSize = workUnitTrials(engine, chunkSize)
+        workUnits = [(start, min(chunkSize, numTrials - start), missing, numTimeStepsAfterDrug, drug,
+                      engine, seed) for start in range(0, numTrials, chunkSize)]
+        simulated = runWorkUnits(workUnits, shapes, executor, maxWorkers, simulateForkedChunk)
+    elif missing:
+        workUnits = []
+        for delay in missing:
+            workUnits.extend(scenarioWorkUnits(delay, numTrials, delay, numTimeStepsAfterDrug, drug, engine,
+                                               chunkSize, seed))
+        simulated = runWorkUnits(workUnits, shapes, executor, maxWorkers)
+    else:
+        simulated = {}
+
+    for delay, (dataMatrixTotal, dataMatrixDrugResistant) in simulated.items():
+        if cache is not None:
+            cache.put(params[delay], {'total': dataMatrixTotal.astype(numpy.int32),
+                                      'resistant': dataMatrixDrugResistant.astype(numpy.int32)})
+        results[delay] = (dataMatrixTotal, dataMatrixDrugResistant)
+    return results
@@ -0,0 +1,155 @@
+"""
+Declarative treatment schedules.
+
+A TreatmentSchedule is a list of events "add drug at step t" / "remove drug
+at step t", on the time grid of ps8S2.simulationWithDrug: an event at step
+t takes effect before the update that produces column t of the trajectory
+matrices. compile() turns a schedule into an array holding the bitmask of
+the drugs active at every step, which the patients take directly through
+setActiveMask() (or, for a whole batch of schedules at once,
+BatchedPatients.setActiveMasks()), so the simulation loops need no
+per-drug branching. Schedules can be written in code or loaded from a JSON
+file such as
+
+    {"events": [[150, "add", "guttagonol"], [300, "add", "grimpex"],
+                [450, "remove", "guttagonol"]]}
+"""
+
+import json
+
+import numpy
+
+# Masks are int64 arrays, so at most this many drugs can be scheduled
+MAX_DRUGS = 63
+
+
+class TreatmentSchedule(object):
+    """
+    Time steps at which drugs are added to or removed from a patient's
+    prescriptions.
+    """
+
+    def __init__(self, events=()):
+        """
+        events: (step, action, drug) triples with action 'add' or
+        'remove', or (step, drug) pairs meaning 'add'. Events at the same
+        step are applied in the order given.
+        """
+        self.events = []
+        for event in events:
+            if len(event) == 2:
+                step, drug = event
+                action = 'add'
+            else:
+                step, action, drug = event
+            if action not in ('add', 'remove'):
+                raise ValueError('unknown schedule action: ' + str(action))
+            if step < 0:
+                raise ValueError('schedule steps must not be negative!')
+            self.events.append((int(step), action, drug))
+        self.events.sort(key=lambda event: event[0])
+
+    @classmethod
+    def load(cls, path):
+        """
+        returns: the schedule in a JSON file holding a list of events, or
+        a dict with the list under 'events'
+        """
+        with open(path) as f:
+            spec = json.load(f)
+        if isinstance(spec, dict):
+            spec = spec['events']
+        return cls(tuple(event) for event in spec)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'events': [list(event) for event in self.events]}, f)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __repr__(self):
+        return 'TreatmentSchedule(%r)' % (self.events,)
+
+    def __eq__(self, other):
+        return isinstance(other, TreatmentSchedule) and self.events == other.events
+
+    def __ne__(self, other):
+        return not self == other
+
+    def drugs(self):
+        """
+        returns: the drugs the schedule mentions, in order of first mention
+        """
+        drugs = []
+        for step, action, drug in self.events:
+            if drug not in drugs:
+                drugs.append(drug)
+        return drugs
+
+    def changeSteps(self):
+        """
+        returns: the sorted steps at which the prescriptions change
+        """
+        return sorted(set(step for step, action, drug in self.events))
+
+    def activeDrugs(self, step):
+        """
+        returns: the drugs prescribed during the update of the given step
+        (a list, in the order they were added)
+        """
+        active = []
+        for eventStep, action, drug in self.events:
+            if eventStep > step:
+                break
+            if action == 'add' and drug not in active:
+                active.append(drug)
+            elif action == 'remove' and drug in active:
+                active.remove(drug)
+        return active
+
+    def compile(self, numTimeSteps, maskOf):
+        """
+        returns: an int64 array of numTimeSteps entries with the bitmask of
+        the drugs active at every step
+
+        maskOf: function mapping a list of drugs to the bitmask a patient
+        uses for them, e.g. virussim.model.DRUG_REGISTRY.mask or
+        GenotypePatient.knownMask
+        """
+        masks = numpy.zeros(numTimeSteps, dtype=numpy.int64)
+        steps = self.changeSteps()
+        for index, step in enumerate(steps):
+            if step >= numTimeSteps:
+                break
+            mask = maskOf(self.activeDrugs(step))
+            if mask >> MAX_DRUGS:
+                raise ValueError('schedules support at most %d drugs' % MAX_DRUGS)
+            end = steps[index + 1] if index + 1 < len(steps) else numTimeSteps
+            masks[step:end] = mask
+        return masks
+
+    def asList(self):
+        """
+        returns: the events as JSON-serializable [step, action, drug] lists
+        """
+        return [[step, action, drug] for step, action, drug in self.events]
+
+
+def asSchedule(prescriptions):
+    """
+    returns: prescriptions as a TreatmentSchedule; prescriptions is a
+    schedule already or a list of events (e.g. (time step, drug) pairs)
+    """
+    if isinstance(prescriptions, TreatmentSchedule):
+        return prescriptions
+    return TreatmentSchedule(prescriptions)
+
+
+def maskChanges(masks):
+    """
+    returns: the steps (after step 0) at which a compiled mask array, or
+    any row of a schedules x numTimeSteps array of them, changes
+    """
+    masks = numpy.atleast_2d(masks)
+    return list(numpy.flatnonzero((masks[:, 1:] != masks[:, :-1]).any(axis=0)) + 1)
@@ -0,0 +1,116 @@
+"""
+Sequential estimation of the cured percentage of a treatment.
+
+Instead of a fixed number of trials, estimateCureRate() simulates trials in
+batches and stops as soon as the Wilson score interval of the cured
+percentage (final total population of at most 50) is narrower than the
+requested width, or when the trial budget is used up. Trials are numbered
+consecutively and each draws from its own stream (virussim.streams), so
+the first n trials of a sequential run are exactly those of a fixed run of
+n trials with the same seed.
+"""
+
+import math
+
+import numpy
+
+from virussim.catalog import CURED_POPULATION
+from virussim.runner import simulateChunk, workUnitTrials
+from virussim.trials import simulateTrajectories
+
+
+def normalQuantile(p):
+    """
+    returns: the p-quantile of the standard normal distribution (found by
+    bisection on math.erf, accurate to ~1e-12)
+    """
+    low, high = -40.0, 40.0
+    while high - low > 1e-12:
+        middle = (low + high) / 2
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def wilsonInterval(successes, trials, confidence=0.95):
+    """
+    returns: the Wilson score interval (low, high) of a binomial proportion
+    with successes out of trials, as fractions
+
+    Unlike the normal approximation it stays inside [0, 1] and keeps its
+    coverage when the proportion is close to 0 or 1, as cure rates often are.
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    z = normalQuantile(0.5 + confidence / 2)
+    proportion = successes / float(trials)
+    denominator = 1 + z * z / trials
+    centre = (proportion + z * z / (2 * trials)) / denominator
+    halfWidth = z * math.sqrt(proportion * (1 - proportion) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, centre - halfWidth), min(1.0, centre + halfWidth)
+
+
+class CureRateEstimate(object):
+    """
+    Result of estimateCureRate(): the cured percentage, its confidence
+    interval (in percent) and how it was reached.
+    """
+
+    def __init__(self, finalTotalPopulations, confidence, targetWidth):
+        self.finalTotalPopulations = list(finalTotalPopulations)
+        self.numTrials = len(self.finalTotalPopulations)
+        self.numCured = sum(1 for population in self.finalTotalPopulations if population <= CURED_POPULATION)
+        self.confidence = confidence
+        self.targetWidth = targetWidth
+        low, high = wilsonInterval(self.numCured, self.numTrials, confidence)
+        self.interval = (100 * low, 100 * high)
+        self.width = self.interval[1] - self.interval[0]
+        self.converged = self.width <= targetWidth
+        self.curedPercentage = 100 * self.numCured / float(self.numTrials) if self.numTrials else float('nan')
+
+    def __repr__(self):
+        return 'CureRateEstimate(%.2f%% cured, %g%% CI [%.2f, %.2f] (width %.2f, target %.2f), %d trials%s)' % (
+            self.curedPercentage, 100 * self.confidence, self.interval[0], self.interval[1], self.width,
+            self.targetWidth, self.numTrials, '' if self.converged else ', budget exhausted')
+
+
+def estimateCureRate(numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug='guttagonol', engine='particle',
+                     targetWidth=2.0, confidence=0.95, batchSize=50, minTrials=50, maxTrials=2000, seed=0,
+                     executor=None, chunkSize=10):
+    """
+    Simulates delayed-treatment trials in batches until the confidence
+    interval of the cured percentage is at most targetWidth percentage
+    points wide (after at least minTrials trials) or maxTrials trials have
+    been run.
+
+    targetWidth: full width of the interval, e.g. 2.0 for +/-1%
+
+    executor: an executor with the concurrent.futures interface (e.g. a
+    ProcessPoolExecutor) to spread every batch over, in work units of
+    chunkSize trials (see virussim.runner.workUnitTrials); None simulates
+    in this process
+
+    returns: a CureRateEstimate
+    """
+    finalTotalPopulations = []
+    while True:
+        firstTrial = len(finalTotalPopulations)
+        numTrials = min(batchSize, maxTrials - firstTrial)
+        if executor is None:
+            dataMatrixTotal = simulateTrajectories(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug,
+                                                         drug, engine, seed, firstTrial)[0]
+            finalTotalPopulations.extend(dataMatrixTotal[:, -1])
+        else:
+            chunkSize = workUnitTrials(engine, chunkSize)
+            workUnits = [(None, start, min(chunkSize, firstTrial + numTrials - start), numTimeStepsBeforeDrug,
+                          numTimeStepsAfterDrug, drug, engine, seed)
+                         for start in range(firstTrial, firstTrial + numTrials, chunkSize)]
+            for chunks in executor.map(simulateChunk, workUnits):
+                for key, start, totalPop, resistPop in chunks:
+                    finalTotalPopulations.extend(numpy.asarray(totalPop[:, -1], dtype=float))
+
+        estimate = CureRateEstimate(finalTotalPopulations, confidence, targetWidth)
+        if (estimate.converged and estimate.numTrials >= minTrials) or estimate.numTrials >= maxTrials:
+            return estimate
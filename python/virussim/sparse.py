@@ -0,0 +1,253 @@
+"""
+Sparse genotype engine for large drug panels.
+
+The genotype-count engine of virussim.genotypes keeps a count for every one
+of the 2^k genotypes over k drugs, which is out of reach beyond ~20 drugs.
+Mutation is rare, though, so a population only ever holds a small number
+of distinct genotypes. SparseGenotypes stores just those, as a sorted array
+of genotype bitmasks with a parallel array of counts, and
+SparseGenotypePatient simulates the same model as GenotypePatient on it:
+memory and the cost of a time step grow with the number of genotypes
+present (plus the number of mutant offspring), not with 2^k. Genotypes are
+int64 bitmasks, so panels of up to 63 drugs are supported.
+"""
+
+import copy
+
+import numpy
+
+from virussim.genotypes import GenotypePatient
+from virussim.model import DrugRegistry
+from virussim.mutation import MAX_BIT, mutantFlipMasks
+
+# Largest panel a sparse patient can hold
+MAX_DRUGS = MAX_BIT + 1
+
+
+def mergeCounts(genotypes, counts):
+    """
+    returns: a tuple (genotypes, counts) of int64 arrays with the counts of
+    equal genotypes added up, the genotypes sorted and those with a count
+    of zero pruned
+    """
+    genotypes = numpy.asarray(genotypes, dtype=numpy.int64)
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    unique, inverse = numpy.unique(genotypes, return_inverse=True)
+    merged = numpy.bincount(inverse, counts, len(unique)).astype(numpy.int64)
+    present = merged != 0
+    return unique[present], merged[present]
+
+
+class SparseGenotypes(object):
+    """
+    Counts of the genotypes (int64 bitmasks) present in a population. Only
+    genotypes with a non-zero count are stored.
+    """
+
+    def __init__(self, genotypes=(), counts=()):
+        """
+        genotypes, counts: parallel sequences of genotypes and their counts;
+        repeated genotypes are added up
+        """
+        self.genotypes, self.counts = mergeCounts(genotypes, counts)
+
+    @classmethod
+    def fromDict(cls, counts):
+        """
+        returns: the SparseGenotypes of a dict mapping genotypes to counts
+        """
+        return cls(list(counts.keys()), list(counts.values()))
+
+    def __len__(self):
+        """
+        returns: the number of distinct genotypes present
+        """
+        return len(self.genotypes)
+
+    def __iter__(self):
+        """
+        Iterates over the (genotype, count) pairs present, in genotype order.
+        """
+        for genotype, count in zip(self.genotypes, self.counts):
+            yield int(genotype), int(count)
+
+    def __getitem__(self, genotype):
+        index = numpy.searchsorted(self.genotypes, genotype)
+        if index < len(self.genotypes) and self.genotypes[index] == genotype:
+            return int(self.counts[index])
+        return 0
+
+    def __repr__(self):
+        return 'SparseGenotypes(%r)' % (self.asDict(),)
+
+    def copy(self):
+        twin = SparseGenotypes.__new__(SparseGenotypes)
+        twin.genotypes = self.genotypes.copy()
+        twin.counts = self.counts.copy()
+        return twin
+
+    def asDict(self):
+        """
+        returns: a dict mapping every genotype present to its count
+        """
+        return dict(self)
+
+    def total(self):
+        """
+        returns: the total count (an integer)
+        """
+        return int(self.counts.sum())
+
+    def resistantCount(self, drugMask):
+        """
+        returns: the total count of the genotypes with every bit of drugMask
+        (an integer) set
+        """
+        return int(self.counts[(self.genotypes & drugMask) == drugMask].sum())
+
+    def merge(self, genotypes, counts):
+        """
+        Adds counts (which may be negative) to genotypes, e.g. the mutant
+        offspring of a time step, pruning the genotypes left at zero.
+        """
+        self.genotypes, self.counts = mergeCounts(numpy.concatenate([self.genotypes, genotypes]),
+                                                  numpy.concatenate([self.counts, counts]))
+
+    def prune(self):
+        """
+        Drops the genotypes whose count is zero, e.g. after the counts array
+        was changed in place.
+        """
+        present = self.counts != 0
+        self.genotypes, self.counts = self.genotypes[present], self.counts[present]
+
+
+def stepSparse(population, maxPop, maxBirthProb, clearProb, mutProb, traitMask, activeMask, rng=numpy.random):
+    """
+    Advances a SparseGenotypes population by a single time step, like
+    virussim.genotypes.stepCounts(): clearance, population density,
+    reproduction of the genotypes resistant to all drugs in activeMask and
+    mutation of the offspring. Of the births of every genotype, the number
+    with at least one of the traits in traitMask flipped is drawn as one
+    binomial; only these mutants get flip masks, so the cost of mutation
+    is proportional to the number of mutants.
+
+    returns: the SparseGenotypes population at the end of the step
+    """
+    genotypes, counts = population.genotypes, population.counts
+    survivors = counts - rng.binomial(counts, clearProb)
+
+    popDensity = survivors.sum() / float(maxPop)
+    birthProb = min(max(maxBirthProb * (1 - popDensity), 0), 1)
+    canReproduce = (genotypes & activeMask) == activeMask
+    births = rng.binomial(survivors * canReproduce, birthProb)
+
+    numTraits = bin(traitMask).count('1')
+    mutants = rng.binomial(births, 1 - (1 - mutProb) ** numTraits)
+
+    nextPopulation = SparseGenotypes.__new__(SparseGenotypes)
+    nextPopulation.genotypes, nextPopulation.counts = genotypes, survivors + births - mutants
+    if mutants.any():
+        parents = numpy.repeat(genotypes, mutants)
+        children = parents ^ mutantFlipMasks(len(parents), traitMask, mutProb, rng)
+        nextPopulation.merge(children, numpy.ones(len(children), dtype=numpy.int64))
+    else:
+        nextPopulation.prune()
+    return nextPopulation
+
+
+class SparseGenotypePatient(GenotypePatient):
+    """
+    GenotypePatient whose population is a SparseGenotypes instead of a
+    dense array of 2^drugs counts, for panels of up to MAX_DRUGS drugs.
+    """
+
+    def __init__(self, population, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng=None):
+        """
+        Initialization function.
+
+        population: the particles per genotype (a SparseGenotypes or a dict
+        mapping genotypes to counts; bit i of a genotype is resistance to
+        drugs[i])
+
+        drugs, maxBirthProb, clearProb, mutProb, maxPop, rng: as in
+        GenotypePatient
+        """
+        if len(drugs) > MAX_DRUGS:
+            raise ValueError('sparse patients support at most %d drugs' % MAX_DRUGS)
+        self.registry = DrugRegistry(drugs)
+        self.population = population if isinstance(population, SparseGenotypes) else \
+            SparseGenotypes.fromDict(population)
+        self.traitMask = (1 << len(self.registry)) - 1
+        self.maxBirthProb = maxBirthProb
+        self.clearProb = clearProb
+        self.mutProb = mutProb
+        self.maxPop = maxPop
+        self.rng = numpy.random if rng is None else rng
+        self.administeredDrugs = []
+        self.activeMask = 0
+
+    def addPrescription(self, newDrug):
+        """
+        Administer a drug to this patient, as in Patient.addPrescription().
+        """
+        if newDrug not in self.administeredDrugs:
+            self.administeredDrugs.append(newDrug)
+            self.activeMask |= self.knownMask([newDrug])
+
+    def setActiveMask(self, activeMask):
+        """
+        Administer exactly the drugs whose bits are set in activeMask, as in
+        GenotypePatient.setActiveMask().
+        """
+        drugs = self.registry.names(activeMask)
+        self.administeredDrugs = [drug for drug in self.administeredDrugs if drug in drugs] + \
+            [drug for drug in drugs if drug not in self.administeredDrugs]
+        self.activeMask = activeMask
+
+    def getTotalPop(self):
+        """
+        returns: The total virus population (an integer)
+        """
+        return self.population.total()
+
+    def getResistPop(self, drugResist):
+        """
+        returns: The population of viruses (an integer) with resistances to
+        all drugs in the drugResist list.
+        """
+        if len(drugResist) == 0:
+            return 0
+        return self.population.resistantCount(self.knownMask(drugResist))
+
+    def fork(self, rng=None):
+        """
+        Snapshot of this patient that evolves independently from here on.
+        Copying the population costs O(genotypes present).
+        """
+        twin = copy.copy(self)
+        twin.population = self.population.copy()
+        twin.administeredDrugs = list(self.administeredDrugs)
+        if rng is not None:
+            twin.rng = rng
+        return twin
+
+    def update(self):
+        """
+        Update the state of the virus population in this patient for a single
+        time step, see stepSparse().
+
+        returns: The total virus population at the end of the update (an integer)
+        """
+        self.population = stepSparse(self.population, self.maxPop, self.maxBirthProb, self.clearProb,
+                                     self.mutProb, self.traitMask, self.activeMask, self.rng)
+        return self.getTotalPop()
+
+
+def initialPopulation(numViruses, resistances, drugs):
+    """
+    returns: the SparseGenotypes of numViruses particles that all have the
+    given resistances dictionary, with bits ordered as drugs.
+    """
+    genotype = DrugRegistry(drugs).mask([drug for drug in drugs if resistances[drug]])
+    return SparseGenotypes([genotype], [numViruses])
@@ -0,0 +1,128 @@
+"""
+Streaming per-time-step statistics of simulated trajectories.
+
+TrajectoryStats takes the trajectories of the trials one at a time (or in
+blocks) and keeps only O(numTimeSteps) state: the count, Welford's running
+mean and sum of squared deviations, the minimum and maximum, and optionally
+a fixed-bin histogram per time step from which quantiles are estimated.
+Blocks and partial results from other processes are combined with Chan's
+parallel update, so the order in which trials arrive does not matter.
+"""
+
+import numpy
+
+
+class TrajectoryStats(object):
+    """
+    Running mean, variance, minimum, maximum and (optionally) quantiles of
+    the populations at every time step.
+    """
+
+    def __init__(self, numTimeSteps, histogramEdges=None):
+        """
+        numTimeSteps: length of the trajectories (an integer)
+
+        histogramEdges: increasing bin edges of the per-time-step histograms
+        used to estimate quantiles (a sequence of floats), or None to keep
+        no histograms. Values outside the edges are counted in the first or
+        last bin.
+        """
+        self.numTimeSteps = numTimeSteps
+        self.count = 0
+        self.mean = numpy.zeros(numTimeSteps)
+        self.sumSquares = numpy.zeros(numTimeSteps)
+        self.min = numpy.full(numTimeSteps, numpy.inf)
+        self.max = numpy.full(numTimeSteps, -numpy.inf)
+        if histogramEdges is None:
+            self.histogramEdges = None
+            self.histogram = None
+        else:
+            self.histogramEdges = numpy.asarray(histogramEdges, dtype=float)
+            self.histogram = numpy.zeros((numTimeSteps, len(self.histogramEdges) - 1), dtype=numpy.int64)
+
+    def add(self, trajectories):
+        """
+        Adds the trajectory of one trial (an array of numTimeSteps
+        populations) or of a block of trials (a trials x numTimeSteps array).
+        """
+        trajectories = numpy.atleast_2d(numpy.asarray(trajectories, dtype=float))
+        if trajectories.shape[1] != self.numTimeSteps:
+            raise ValueError('trajectories must have numTimeSteps columns!')
+        if len(trajectories) == 0:
+            return
+        if len(trajectories) == 1:
+            # Welford's update for a single trial
+            row = trajectories[0]
+            self.count += 1
+            delta = row - self.mean
+            self.mean += delta / self.count
+            self.sumSquares += delta * (row - self.mean)
+            self.min = numpy.minimum(self.min, row)
+            self.max = numpy.maximum(self.max, row)
+            if self.histogram is not None:
+                self.histogram[numpy.arange(self.numTimeSteps), self.binsOf(row)] += 1
+            return
+
+        block = TrajectoryStats(self.numTimeSteps, self.histogramEdges)
+        block.count = len(trajectories)
+        block.mean = trajectories.mean(axis=0)
+        block.sumSquares = ((trajectories - block.mean) ** 2).sum(axis=0)
+        block.min = trajectories.min(axis=0)
+        block.max = trajectories.max(axis=0)
+        if block.histogram is not None:
+            bins = self.binsOf(trajectories)
+            for time in range(self.numTimeSteps):
+                block.histogram[time] = numpy.bincount(bins[:, time], minlength=block.histogram.shape[1])
+        self.merge(block)
+
+    def merge(self, other):
+        """
+        Adds the trials summarized by another TrajectoryStats with the same
+        numTimeSteps and histogram edges, e.g. one filled by a worker process.
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / float(count))
+        self.sumSquares = self.sumSquares + other.sumSquares + delta ** 2 * (self.count * other.count / float(count))
+        self.count = count
+        self.min = numpy.minimum(self.min, other.min)
+        self.max = numpy.maximum(self.max, other.max)
+        if self.histogram is not None:
+            self.histogram += other.histogram
+
+    def binsOf(self, values):
+        bins = numpy.searchsorted(self.histogramEdges, values, side='right') - 1
+        return numpy.clip(bins, 0, len(self.histogramEdges) - 2)
+
+    def variance(self, ddof=0):
+        """
+        returns: the variance at every time step (ddof=0 matches
+        numpy.std(axis=0) on the full trajectory matrix)
+        """
+        if self.count - ddof <= 0:
+            return numpy.full(self.numTimeSteps, numpy.nan)
+        return self.sumSquares / (self.count - ddof)
+
+    def std(self, ddof=0):
+        return numpy.sqrt(self.variance(ddof))
+
+    def quantile(self, q):
+        """
+        returns: the estimated q-quantile (0 <= q <= 1) at every time step,
+        interpolated linearly inside the histogram bin that contains it
+        """
+        if self.histogram is None:
+            raise ValueError('quantiles need histogramEdges!')
+        cumulative = numpy.cumsum(self.histogram, axis=1)
+        target = q * self.count
+        result = numpy.zeros(self.numTimeSteps)
+        for time in range(self.numTimeSteps):
+            index = min(numpy.searchsorted(cumulative[time], target), self.histogram.shape[1] - 1)
+            below = cumulative[time][index - 1] if index > 0 else 0
+            inBin = self.histogram[time][index]
+            fraction = (target - below) / float(inBin) if inBin else 0.0
+            left, right = self.histogramEdges[index], self.histogramEdges[index + 1]
+            result[time] = left + min(max(fraction, 0.0), 1.0) * (right - left)
+        return result
@@ -0,0 +1,135 @@
+"""
+Out-of-core trajectory storage backed by numpy.memmap files.
+
+A TrajectoryStore is a directory holding the total and drug resistant
+populations of every trial as two int32 numTrials x numTimeSteps matrices in
+raw row-major files, plus a small JSON header with their shape. Trials are
+written chunk by chunk as they finish, so the full matrices never have to
+fit in memory, and analysis code can reopen the files read-only without
+copying them. The chunked* helpers reduce such matrices over the trials a
+block of rows at a time.
+"""
+
+import json
+import os
+
+import numpy
+
+from virussim.stats import TrajectoryStats
+
+# Default number of trials read at a time by the chunked reductions
+CHUNK_ROWS = 4096
+
+
+class TrajectoryStore(object):
+    """
+    Memory-mapped total and drug resistant population matrices.
+    """
+
+    def __init__(self, directory, numTrials=None, numTimeSteps=None, mode='r'):
+        """
+        directory: where the files are kept (created if missing)
+
+        numTrials, numTimeSteps: shape of the matrices; required when a new
+        store is created and read from the header otherwise
+
+        mode: 'w+' creates (or overwrites) the store, 'r+' opens an existing
+        one for writing and 'r' opens it read-only
+        """
+        self.directory = directory
+        header = os.path.join(directory, 'header.json')
+        if mode == 'w+':
+            if numTrials is None or numTimeSteps is None:
+                raise ValueError('a new store needs numTrials and numTimeSteps!')
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(header, 'w') as f:
+                json.dump({'numTrials': numTrials, 'numTimeSteps': numTimeSteps, 'dtype': 'int32'}, f)
+        else:
+            with open(header) as f:
+                shape = json.load(f)
+            numTrials, numTimeSteps = shape['numTrials'], shape['numTimeSteps']
+        self.numTrials = numTrials
+        self.numTimeSteps = numTimeSteps
+        self.total = numpy.memmap(os.path.join(directory, 'total.dat'), dtype=numpy.int32, mode=mode, \
+            shape=(numTrials, numTimeSteps))
+        self.resistant = numpy.memmap(os.path.join(directory, 'resistant.dat'), dtype=numpy.int32, mode=mode, \
+            shape=(numTrials, numTimeSteps))
+
+    def __len__(self):
+        return self.numTrials
+
+    def write(self, start, totalPop, resistPop):
+        """
+        Stores the trajectories of trials start, start + 1, ... (arrays of
+        one trial or trials x numTimeSteps arrays).
+
+        returns: the number of trials written
+        """
+        totalPop = numpy.atleast_2d(totalPop)
+        resistPop = numpy.atleast_2d(resistPop)
+        self.total[start:start + len(totalPop)] = totalPop
+        self.resistant[start:start + len(resistPop)] = resistPop
+        return len(totalPop)
+
+    def fill(self, blocks, start=0):
+        """
+        Writes the (totalPop, resistPop) blocks produced by e.g.
+        virussim.trials.iterateTrajectories or virussim.runner.iterateTrials
+        one after the other, starting at trial start, and flushes the files.
+        """
+        for totalPop, resistPop in blocks:
+            start += self.write(start, totalPop, resistPop)
+        self.flush()
+
+    def flush(self):
+        self.total.flush()
+        self.resistant.flush()
+
+
+def chunkedStats(matrix, chunkSize=CHUNK_ROWS):
+    """
+    returns: a TrajectoryStats of the rows of matrix (e.g. a memmap), read
+    chunkSize rows at a time
+    """
+    stats = TrajectoryStats(matrix.shape[1])
+    for start in range(0, len(matrix), chunkSize):
+        stats.add(matrix[start:start + chunkSize])
+    return stats
+
+
+def chunkedMean(matrix, chunkSize=CHUNK_ROWS):
+    """
+    returns: matrix.mean(0), computed chunkSize rows at a time
+    """
+    return chunkedStats(matrix, chunkSize).mean
+
+
+def chunkedStd(matrix, chunkSize=CHUNK_ROWS):
+    """
+    returns: matrix.std(0), computed chunkSize rows at a time
+    """
+    return chunkedStats(matrix, chunkSize).std()
+
+
+def chunkedHistogram(matrix, bins, timeStep=-1, chunkSize=CHUNK_ROWS):
+    """
+    returns: a tuple (counts, edges) like numpy.histogram of the
+    populations of all trials at one time step (the last by default),
+    computed chunkSize rows at a time
+
+    bins: the bin edges (a sequence), or the number of bins spread over
+    the range of the column
+    """
+    if numpy.isscalar(bins):
+        low, high = None, None
+        for start in range(0, len(matrix), chunkSize):
+            column = matrix[start:start + chunkSize, timeStep]
+            low = column.min() if low is None else min(low, column.min())
+            high = column.max() if high is None else max(high, column.max())
+        bins = numpy.linspace(low, high if high > low else low + 1, bins + 1)
+    edges = numpy.asarray(bins, dtype=float)
+    counts = numpy.zeros(len(edges) - 1, dtype=numpy.int64)
+    for start in range(0, len(matrix), chunkSize):
+        counts += numpy.histogram(matrix[start:start + chunkSize, timeStep], edges)[0]
+    return counts, edges
@@ -0,0 +1,46 @@
+"""
+Reproducible per-trial random number streams.
+
+Every trial of a simulation draws from its own generator, derived from a
+root seed and the index of the trial only. A trial therefore produces the
+same trajectory no matter how the trials are split into chunks or spread
+over worker processes.
+"""
+
+import random
+
+import numpy
+
+
+def trialSeed(seed, trial, *branch):
+    """
+    returns: the seed of one trial (a list of four 32-bit integers).
+    Derived with numpy.random.SeedSequence as the trial-th child of the root
+    seed where available, and by seeding a RandomState with [seed, trial]
+    on older numpy versions.
+
+    branch: further non-negative integers identifying a branch of the trial
+    forked off with Patient.fork(), e.g. a prescription time
+    """
+    key = (trial,) + branch
+    if hasattr(numpy.random, 'SeedSequence'):
+        sequence = numpy.random.SeedSequence(seed, spawn_key=key)
+        return [int(word) for word in sequence.generate_state(4)]
+    return [int(word) for word in numpy.random.RandomState([seed] + list(key)).randint(2 ** 32, size=4)]
+
+
+def numpyGenerator(seed, trial, *branch):
+    """
+    returns: the numpy.random.RandomState of one trial, for the engines
+    that draw with the numpy.random interface.
+    """
+    return numpy.random.RandomState(trialSeed(seed, trial, *branch))
+
+
+def particleGenerator(seed, trial, *branch):
+    """
+    returns: the random.Random of one trial, for the particle patients of
+    ps7_v1 and ps8S2 that draw with random().
+    """
+    words = trialSeed(seed, trial, *branch)
+    return random.Random(sum(word << (32 * i) for i, word in enumerate(words)))
@@ -0,0 +1,198 @@
+"""
+Parallel parameter sweeps over the virus and treatment parameters.
+
+A sweep is a list of parameter points: dicts with values for some of
+maxBirthProb, clearProb, mutProb, maxPop, numViruses (see
+virussim.model.simulationParameters) and delay, the number of time steps
+before the drug is added. gridDesign() builds the points of a full grid and
+latinHypercube() those of a Latin hypercube design. runSweep() simulates
+numTrials trials of every point: the (point x trial) work is cut into work
+units of at most unitTrials trials, with the trials of small points packed
+together so that thousands of points do not mean thousands of tiny tasks,
+and the units are spread over a process pool. Every trial becomes one row
+of a tidy table (point, trial, parameters, final populations), streamed
+to a CSV file as the units finish.
+
+Trial t of every point draws from the stream of trial t (see
+virussim.streams), so points are compared with common random numbers and
+the rows do not depend on unitTrials or the number of workers (except with
+the batched engine, whose trials share a stream per piece).
+"""
+
+import csv
+import itertools
+import sys
+
+import numpy
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from virussim.catalog import CURED_POPULATION
+from virussim.model import simulationParameters
+from virussim.trials import simulateTrajectories
+
+# Parameters a point may set, besides delay
+VIRUS_PARAMETERS = ('maxBirthProb', 'clearProb', 'mutProb', 'maxPop', 'numViruses')
+INTEGER_PARAMETERS = ('delay', 'maxPop', 'numViruses')
+
+# Delay of the points that do not set one
+DEFAULT_DELAY = 150
+
+# Default maximum number of trials per work unit
+UNIT_TRIALS = 50
+
+COLUMNS = ['point', 'trial', 'maxBirthProb', 'clearProb', 'mutProb', 'maxPop', 'numViruses', 'delay',
+           'engine', 'finalTotalPop', 'finalResistPop', 'cured']
+
+
+def gridDesign(**axes):
+    """
+    returns: the points of the full grid over the given axes, e.g.
+    gridDesign(mutProb=[0.001, 0.005], delay=[0, 75, 150, 300]) (a list of
+    dicts, the last axis in alphabetical order varying fastest)
+    """
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*[axes[name] for name in names])]
+
+
+def latinHypercube(numPoints, ranges, seed=0):
+    """
+    returns: numPoints points of a Latin hypercube design: the range of
+    every parameter is cut into numPoints equal strata and every stratum
+    holds exactly one point, at a uniformly random position
+
+    ranges: a dict mapping parameter names to (low, high) pairs; delay,
+    maxPop and numViruses are rounded to integers
+    """
+    rng = numpy.random.RandomState(seed)
+    names = sorted(ranges)
+    points = [{} for point in range(numPoints)]
+    for name in names:
+        low, high = ranges[name]
+        strata = rng.permutation(numPoints)
+        values = low + (strata + rng.random_sample(numPoints)) / float(numPoints) * (high - low)
+        for point, value in zip(points, values):
+            point[name] = int(round(value)) if name in INTEGER_PARAMETERS else float(value)
+    return points
+
+
+def sweepWorkUnits(points, numTrials, unitTrials=UNIT_TRIALS):
+    """
+    returns: the work units of a sweep, lists of pieces (pointIndex, point,
+    firstTrial, numTrials) holding at most unitTrials trials together;
+    points with more trials are split, smaller ones packed
+    """
+    units, current, size = [], [], 0
+    for index, point in enumerate(points):
+        for start in range(0, numTrials, unitTrials):
+            count = min(unitTrials, numTrials - start)
+            if current and size + count > unitTrials:
+                units.append(current)
+                current, size = [], 0
+            current.append((index, point, start, count))
+            size += count
+    if current:
+        units.append(current)
+    return units
+
+
+def simulateSweepUnit(workUnit):
+    """
+    Worker function: simulates the pieces of one work unit.
+
+    workUnit: a tuple (pieces, numTimeStepsAfterDrug, drug, engine, seed),
+    see sweepWorkUnits
+
+    returns: the rows (dicts with the COLUMNS) of the trials of the unit
+    """
+    pieces, numTimeStepsAfterDrug, drug, engine, seed = workUnit
+    rows = []
+    for index, point, firstTrial, numTrials in pieces:
+        parameters = dict((name, point[name]) for name in VIRUS_PARAMETERS if name in point)
+        delay = point.get('delay', DEFAULT_DELAY)
+        dataMatrixTotal, dataMatrixDrugResistant = simulateTrajectories(numTrials, delay, \
+            numTimeStepsAfterDrug, drug, engine, seed, firstTrial, parameters=parameters)
+        values = simulationParameters()
+        values.update(parameters)
+        for trial in range(numTrials):
+            finalTotalPop = int(dataMatrixTotal[trial, -1])
+            rows.append({'point': index, 'trial': firstTrial + trial, 'maxBirthProb': values['maxBirthProb'],
+                         'clearProb': values['clearProb'], 'mutProb': values['mutProb'],
+                         'maxPop': values['maxPop'], 'numViruses': values['numViruses'], 'delay': delay,
+                         'engine': engine, 'finalTotalPop': finalTotalPop,
+                         'finalResistPop': int(dataMatrixDrugResistant[trial, -1]),
+                         'cured': int(finalTotalPop <= CURED_POPULATION)})
+    return rows
+
+
+def iterateSweep(points, numTrials=10, numTimeStepsAfterDrug=150, drug='guttagonol', engine='genotype',
+                 seed=0, unitTrials=UNIT_TRIALS, executor=None, maxWorkers=None):
+    """
+    Runs a sweep over a process pool and yields the row of every trial as
+    soon as its work unit finishes (so in no particular order).
+
+    executor: an executor with the concurrent.futures interface to use; a
+    ProcessPoolExecutor with maxWorkers processes is created if it is None
+    """
+    workUnits = [(pieces, numTimeStepsAfterDrug, drug, engine, seed)
+                 for pieces in sweepWorkUnits(points, numTrials, unitTrials)]
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = ProcessPoolExecutor(max_workers=maxWorkers)
+    try:
+        futures = [executor.submit(simulateSweepUnit, workUnit) for workUnit in workUnits]
+        for future in as_completed(futures):
+            for row in future.result():
+                yield row
+    finally:
+        if ownExecutor:
+            executor.shutdown()
+
+
+def openCsv(path):
+    if sys.version_info[0] < 3:
+        return open(path, 'wb')
+    return open(path, 'w', newline='')
+
+
+def runSweep(points, path, numTrials=10, numTimeStepsAfterDrug=150, drug='guttagonol', engine='genotype',
+             seed=0, unitTrials=UNIT_TRIALS, executor=None, maxWorkers=None):
+    """
+    Runs a sweep (see iterateSweep) and writes its rows to a CSV file with
+    the COLUMNS as they arrive.
+
+    returns: the number of rows written
+    """
+    numRows = 0
+    with openCsv(path) as f:
+        writer = csv.DictWriter(f, COLUMNS)
+        writer.writeheader()
+        for row in iterateSweep(points, numTrials, numTimeStepsAfterDrug, drug, engine, seed, unitTrials,
+                                executor, maxWorkers):
+            writer.writerow(row)
+            numRows += 1
+    return numRows
+
+
+def summarizeSweep(rows):
+    """
+    returns: a dict mapping every point index to a dict with its parameters,
+    the number of trials, the cured percentage and the mean final total and
+    drug resistant populations
+    """
+    summaries = {}
+    for row in rows:
+        point = int(row['point'])
+        if point not in summaries:
+            summaries[point] = dict((name, row[name]) for name in COLUMNS[2:9])
+            summaries[point].update({'numTrials': 0, 'cured': 0, 'totalPop': 0.0, 'resistPop': 0.0})
+        summary = summaries[point]
+        summary['numTrials'] += 1
+        summary['cured'] += int(row['cured'])
+        summary['totalPop'] += float(row['finalTotalPop'])
+        summary['resistPop'] += float(row['finalResistPop'])
+    for summary in summaries.values():
+        numTrials = float(summary['numTrials'])
+        summary['curedPercentage'] = 100 * summary.pop('cured') / numTrials
+        summary['meanFinalPop'] = summary.pop('totalPop') / numTrials
+        summary['meanFinalResistPop'] = summary.pop('resistPop') / numTrials
+    return summaries
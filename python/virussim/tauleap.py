@@ -0,0 +1,210 @@
+"""
+Multi-step tau-leaping engine for the genotype-count model of
+virussim.genotypes.
+
+Instead of drawing every time step, a leap advances tau steps at once with
+the population density frozen at its value at the start of the leap, and
+draws the clearances and births of the whole leap as Poisson numbers of
+events. tau is chosen adaptively so that the expected change and the
+standard deviation of the reproducing population stay within a fraction
+epsilon of its size (Cao, Gillespie & Petzold step-size selection), while
+the particles that cannot reproduce under the prescriptions decay exactly.
+This allows long leaps on the plateau near maxPop, with or without drugs,
+and falls back to exact single steps for small populations and while a
+few resistant particles decide the outcome of a treatment.
+"""
+
+import numpy
+
+from virussim.genotypes import GenotypePatient, mutateCounts, resistantGenotypes
+from virussim.schedule import asSchedule, maskChanges
+
+
+class TauLeapPatient(GenotypePatient):
+    """
+    GenotypePatient that can advance several time steps per draw with
+    advance(). update() still performs an exact single step.
+    """
+
+    def __init__(self, counts, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng=None,
+                 epsilon=0.03, maxLeap=100, minPop=100):
+        """
+        Initialization function; the first arguments are as in
+        GenotypePatient.
+
+        epsilon: the largest expected relative change of the reproducing
+        population (and of its birth probability) during one leap (a float)
+
+        maxLeap: the largest number of time steps per leap (an integer)
+
+        minPop: below this total population only exact single steps are
+        taken (an integer)
+        """
+        GenotypePatient.__init__(self, counts, drugs, maxBirthProb, clearProb, mutProb, maxPop, rng)
+        self.epsilon = epsilon
+        self.maxLeap = maxLeap
+        self.minPop = minPop
+        self.numLeaps = 0
+
+    def birthProb(self):
+        """
+        returns: the per-step birth probability of a resistant particle at
+        the current population density, taking the clearance that precedes
+        reproduction in a step into account (a float)
+        """
+        popDensity = self.getTotalPop() * (1 - self.clearProb) / float(self.maxPop)
+        return min(max(self.maxBirthProb * (1 - popDensity), 0), 1)
+
+    def leapSize(self, maxSteps):
+        """
+        Chooses the length of the next leap. Only the particles that can
+        reproduce under the current prescriptions are bounded: their
+        expected net change per step (births that stay reproducing minus
+        clearances) and its standard deviation may reach at most epsilon of
+        their number over the leap, and so may the birth probability, which
+        follows the total population through the density. The other
+        particles only decay, which leap() draws exactly however long the
+        leap, so a small non-reproducing class that is draining anyway does
+        not force single steps. A reproducing class of fewer than minPop
+        particles (e.g. a few resistant particles right after a
+        prescription, whose survival decides the cure) does.
+
+        returns: the number of time steps (an integer between 1 and maxSteps)
+        the next leap may cover.
+        """
+        total = self.getTotalPop()
+        if maxSteps <= 1 or total < self.minPop:
+            return 1
+
+        tau = min(maxSteps, self.maxLeap)
+        reproducing = int(self.counts[self.canReproduce].sum())
+        if reproducing == 0:
+            return tau
+        if reproducing < self.minPop:
+            return 1
+
+        survival = 1 - self.clearProb
+        birthProb = self.birthProb()
+        # A child of a reproducing particle stays reproducing unless one of
+        # its traits for the active drugs flips
+        staying = (1 - self.mutProb) ** bin(self.activeMask).count('1')
+        drift = reproducing * (survival * birthProb * staying - self.clearProb)
+        variance = reproducing * (survival * birthProb + self.clearProb)
+        allowed = self.epsilon * reproducing
+        if drift != 0:
+            tau = min(tau, allowed / abs(drift))
+        if variance > 0:
+            tau = min(tau, allowed ** 2 / variance)
+
+        # The density is frozen during a leap: bound the change of the birth
+        # probability it causes, from the drift of the total population
+        others = total - reproducing
+        totalDrift = reproducing * (survival * birthProb - self.clearProb) - others * self.clearProb
+        birthDrift = self.maxBirthProb * survival * abs(totalDrift) / float(self.maxPop)
+        if birthDrift > 0 and birthProb > 0:
+            tau = min(tau, self.epsilon * birthProb / birthDrift)
+        return max(1, int(tau))
+
+    def leap(self, tau):
+        """
+        Advance the population by tau time steps in one draw. The particles
+        that cannot reproduce survive the leap with probability
+        (1 - clearProb) ** tau each, drawn exactly as one binomial per
+        genotype; the clearances and births of the reproducing particles are
+        drawn as Poisson numbers of events at the rates of the current time
+        step.
+        """
+        survival = 1 - self.clearProb
+        reproducing = self.counts * self.canReproduce
+        others = self.counts - reproducing
+        clearances = self.rng.poisson(reproducing * (self.clearProb * tau))
+        births = self.rng.poisson(reproducing * (survival * self.birthProb() * tau))
+
+        # Over a long leap a class is cleared and replenished several times
+        # over, so only the net change is bounded by the current counts.
+        offspring = mutateCounts(births, len(self.registry), self.mutProb, self.rng)
+        self.counts = numpy.maximum(reproducing - clearances + offspring, 0) + \
+            self.rng.binomial(others, survival ** tau)
+        self.numLeaps += 1
+
+    def advance(self, numSteps):
+        """
+        Advance the population by numSteps time steps, leaping where the
+        step-size selection allows it. Counts inside a leap are linearly
+        interpolated between its end points. An extinct population stays
+        extinct, so the steps after extinction are not simulated.
+
+        returns: the counts per genotype after each of the time steps (a
+        numSteps x genotypes integer array)
+        """
+        history = numpy.zeros((numSteps, len(self.counts)), dtype=numpy.int64)
+        step = 0
+        while step < numSteps:
+            if not self.counts.any():
+                break
+            tau = self.leapSize(numSteps - step)
+            start = self.counts
+            if tau == 1:
+                self.update()
+            else:
+                self.leap(tau)
+            fractions = numpy.arange(1, tau + 1)[:, numpy.newaxis] / float(tau)
+            history[step:step + tau] = numpy.rint(start + (self.counts - start) * fractions)
+            step += tau
+        return history
+
+
+def recordTrajectory(patient, numTimeSteps, prescriptions, drugResist):
+    """
+    Simulates a TauLeapPatient on the time grid of ps8S2.simulationWithDrug:
+    entry 0 is the initial population and entry t the population after the
+    t-th step. Leaps never cross a prescription.
+
+    prescriptions: a virussim.schedule.TreatmentSchedule, or (time step,
+    drug name) pairs; the drug is added before the step of that time
+
+    drugResist: drugs whose jointly resistant population is recorded
+
+    returns: a tuple (totalPop, resistPop) of float arrays of length
+    numTimeSteps
+    """
+    totalPop, resistPops = recordResistances(patient, numTimeSteps, prescriptions, [drugResist])
+    return totalPop, resistPops[0]
+
+
+def recordResistances(patient, numTimeSteps, prescriptions, drugGroups):
+    """
+    Simulates a TauLeapPatient as recordTrajectory(), recording the
+    population resistant to every group of drugs in drugGroups (a list of
+    lists of drug names; an empty group records 0).
+
+    returns: a tuple (totalPop, resistPops) of a float array of length
+    numTimeSteps and a list with one such array per group
+    """
+    masks = asSchedule(prescriptions).compile(numTimeSteps, patient.knownMask)
+    changes = maskChanges(masks)
+
+    totalPop = numpy.zeros(numTimeSteps)
+    resistPops = [numpy.zeros(numTimeSteps) for drugResist in drugGroups]
+
+    patient.setActiveMask(int(masks[0]))
+    totalPop[0] = patient.getTotalPop()
+    resistant = []
+    for drugResist, resistPop in zip(drugGroups, resistPops):
+        resistPop[0] = patient.getResistPop(drugResist)
+        if len(drugResist) == 0:
+            resistant.append(numpy.zeros(len(patient.counts), dtype=bool))
+        else:
+            resistant.append(resistantGenotypes(len(patient.counts), patient.knownMask(drugResist)))
+
+    time = 1
+    while time < numTimeSteps:
+        patient.setActiveMask(int(masks[time]))
+        nextTime = min([t for t in changes if t > time] + [numTimeSteps])
+        history = patient.advance(nextTime - time)
+        totalPop[time:nextTime] = history.sum(axis=1)
+        for genotypes, resistPop in zip(resistant, resistPops):
+            resistPop[time:nextTime] = history[:, genotypes].sum(axis=1)
+        time = nextTime
+
+    return totalPop, resistPops
@@ -0,0 +1,266 @@
+"""
+Trial drivers of the delayed-treatment simulations of ps8S2: they simulate
+numbered trials of any engine (see virussim.model.resistantPatient) from
+per-trial random streams and return or yield their trajectories without
+plotting anything. ps8S2 and virussim.runner, sweep and sequential build
+on them.
+"""
+
+import numpy
+
+from virussim.model import resistantPatient, simulationParameters
+
+
+# Number of trials the batched engine simulates together in a process:
+# large enough to amortize the per-step overhead over the batch, small
+# enough to bound the memory of its trajectories (a few MB)
+BATCHED_BLOCK_TRIALS = 500
+
+
+def cacheParameters(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, drug, engine, seed, \
+    forked=False):
+    """
+    Returns everything that determines the trajectories of a run (a dict),
+    the key of its entry in a virussim.cache.ResultCache.
+
+    The batched engine's results depend on the number of trials simulated
+    together, which is BATCHED_BLOCK_TRIALS whether the blocks are run in
+    this process or by virussim.runner, so it is part of the key.
+    """
+    params = simulationParameters()
+    params.update({'numTrials': numTrials, 'schedule': [[numTimeStepsBeforeDrug, drug]],
+                   'numTimeSteps': numTimeStepsBeforeDrug + numTimeStepsAfterDrug, 'drugResist': [drug],
+                   'engine': engine, 'seed': seed, 'forked': forked,
+                   'chunkSize': min(BATCHED_BLOCK_TRIALS, numTrials) if engine == 'batched' else None})
+    return params
+
+
+def iterateTrajectories(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug='guttagonol', \
+    engine='particle', seed=0, firstTrial=0, profiles=None, schedule=None, parameters=None, \
+    blockTrials=BATCHED_BLOCK_TRIALS):
+    """
+    Runs the trials of ps8S2.simulationWithDrug without plotting anything,
+    and yields their trajectories as they finish.
+
+    engine selects how each patient is simulated, see
+    virussim.model.resistantPatient(). engine='batched' advances blocks of
+    blockTrials trials together with virussim.batched.simulateTrials
+    instead, so that no more than one block of trajectories is held at a
+    time.
+
+    seed, firstTrial: the trials are numbered from firstTrial on, and every
+    trial draws from its own generator derived from seed and its number
+    (see virussim.streams), so a trial's trajectory does not depend on
+    which other trials are simulated with it. The batched engine draws
+    every block from the generator of its first trial, so its results
+    depend on blockTrials.
+
+    profiles: a list; if given, every trial of the particle engine is
+    profiled (see virussim.profiling) and its UpdateProfile is appended
+
+    schedule: a virussim.schedule.TreatmentSchedule to follow instead of
+    adding drug after numTimeStepsBeforeDrug steps; the particles carry
+    (initially absent) resistance traits for all of its drugs, and the
+    population resistant to all of them is recorded
+
+    parameters: a dict overriding some of the simulationParameters(), e.g.
+    {'mutProb': 0.01}
+
+    Yields tuples (totalPop, resistPop) of arrays with the total and drug
+    resistant populations at every time step of one trial, or of a block
+    of trials (blockTrials x numTimeSteps arrays, the last block possibly
+    smaller) for the batched engine
+    """
+
+    from virussim.schedule import TreatmentSchedule
+    from virussim.streams import numpyGenerator, particleGenerator
+
+    params = simulationParameters()
+    params.update(parameters or {})
+    maxPop = params['maxPop']
+    numViruses = params['numViruses']
+    numTimeSteps = numTimeStepsBeforeDrug + numTimeStepsAfterDrug
+
+    # Virus Characteristics
+    maxBirthProb = params['maxBirthProb']
+    clearProb = params['clearProb']
+    resistances = params['resistances']
+    mutProb = params['mutProb']
+
+    if schedule is None:
+        schedule = TreatmentSchedule([(numTimeStepsBeforeDrug, drug)])
+        drugResist = [drug]
+    else:
+        drugResist = schedule.drugs()
+        resistances = dict((scheduledDrug, False) for scheduledDrug in drugResist)
+        resistances.update(params['resistances'])
+
+    if engine == 'batched':
+        from virussim.batched import simulateTrials
+        for start in range(0, numTrials, blockTrials):
+            yield simulateTrials(min(blockTrials, numTrials - start), numTimeSteps, numViruses, maxBirthProb, \
+                clearProb, resistances, mutProb, maxPop, schedule, drugResist, \
+                numpyGenerator(seed, firstTrial + start))
+        return
+
+    for trial in range(numTrials):
+        # print "trial =", trial
+        # Model a random patient with the given virus charateristics
+        if engine == 'particle':
+            rng = particleGenerator(seed, firstTrial + trial)
+        else:
+            rng = numpyGenerator(seed, firstTrial + trial)
+        randPatientX = resistantPatient(engine, numViruses, maxBirthProb, clearProb, resistances, mutProb, maxPop, rng)
+        if profiles is not None and engine == 'particle':
+            from virussim.profiling import UpdateProfile
+            randPatientX.profile = UpdateProfile()
+            profiles.append(randPatientX.profile)
+
+        if engine == 'tauleap':
+            from virussim.tauleap import recordTrajectory
+            yield recordTrajectory(randPatientX, numTimeSteps, schedule, drugResist)
+        else:
+            yield recordSchedule(randPatientX, numTimeSteps, schedule, drugResist)
+
+
+def recordSchedule(patient, numTimeSteps, schedule, drugResist):
+    """
+    Simulates one patient (of any engine but 'batched') under a treatment
+    schedule, on the time grid of ps8S2.simulationWithDrug: entry 0 is the
+    initial population and entry t the population after the t-th update.
+
+    The schedule is compiled to one drug mask per time step, and the
+    patient's prescriptions are only touched where the mask changes. Once
+    the population dies out the patient is cured for good (no particle is
+    left to reproduce), so the simulation stops there and the rest of the
+    trajectory is left at 0.
+
+    schedule: a virussim.schedule.TreatmentSchedule
+
+    drugResist: drugs whose jointly resistant population is recorded
+
+    Returns a tuple (totalPop, resistPop) of arrays of numTimeSteps populations
+    """
+    from virussim.schedule import maskChanges
+
+    masks = schedule.compile(numTimeSteps, patient.knownMask)
+    totalPop = numpy.zeros(numTimeSteps)
+    resistPop = numpy.zeros(numTimeSteps)
+
+    patient.setActiveMask(int(masks[0]))
+    totalPop[0] = patient.getTotalPop()
+    resistPop[0] = patient.getResistPop(drugResist)
+    if totalPop[0] == 0:
+        return totalPop, resistPop
+
+    # Simulate the time-steps, one stretch of constant prescriptions at a time
+    bounds = [1] + maskChanges(masks) + [numTimeSteps]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        patient.setActiveMask(int(masks[start]))
+        for time in range(start, end):
+            totalPop[time] = patient.update()
+            resistPop[time] = patient.getResistPop(drugResist)
+            if totalPop[time] == 0:
+                return totalPop, resistPop
+
+    return totalPop, resistPop
+
+
+def simulateTrajectories(numTrials=10, numTimeStepsBeforeDrug=150, numTimeStepsAfterDrug=150, drug='guttagonol', \
+    engine='particle', seed=0, firstTrial=0, profiles=None, schedule=None, parameters=None):
+    """
+    Runs the trials of ps8S2.simulationWithDrug without plotting anything,
+    see iterateTrajectories().
+
+    Returns a tuple (dataMatrixTotal, dataMatrixDrugResistant) of
+    numTrials x numTimeSteps arrays with the total and drug resistant
+    populations of every trial and time step
+    """
+
+    numTimeSteps = numTimeStepsBeforeDrug + numTimeStepsAfterDrug
+    dataMatrixTotal = numpy.zeros(shape=(numTrials, numTimeSteps))
+    dataMatrixDrugResistant = numpy.zeros(shape=(numTrials, numTimeSteps))
+
+    trial = 0
+    for totalPop, resistPop in iterateTrajectories(numTrials, numTimeStepsBeforeDrug, numTimeStepsAfterDrug, \
+        drug, engine, seed, firstTrial, profiles, schedule, parameters):
+        rows = len(numpy.atleast_2d(totalPop))
+        dataMatrixTotal[trial:trial + rows] = totalPop
+        dataMatrixDrugResistant[trial:trial + rows] = resistPop
+        trial += rows
+
+    return dataMatrixTotal, dataMatrixDrugResistant
+
+
+def simulateForkedTrajectories(numTrials=10, delays=(300, 150, 75, 0), numTimeStepsAfterDrug=150, \
+    drug='guttagonol', engine='particle', seed=0, firstTrial=0):
+    """
+    Runs the trials of several ps8S2.simulationDelayedTreatment scenarios at
+    once. The drug-free phase of every trial is simulated only once, up to the
+    longest delay, and the patient is forked at each delay into a branch
+    that receives the drug and runs numTimeStepsAfterDrug more steps.
+
+    The scenarios of a trial share their drug-free history, so they are
+    compared with common random numbers. Each branch draws from its own
+    stream, derived from seed, the trial number and the delay.
+
+    Returns a dict mapping every delay to a tuple (dataMatrixTotal,
+    dataMatrixDrugResistant) of numTrials x (delay + numTimeStepsAfterDrug)
+    arrays, laid out as by simulateTrajectories
+    """
+    from virussim.streams import numpyGenerator, particleGenerator
+
+    params = simulationParameters()
+    maxPop = params['maxPop']
+    numViruses = params['numViruses']
+
+    # Virus Characteristics
+    maxBirthProb = params['maxBirthProb']
+    clearProb = params['clearProb']
+    resistances = params['resistances']
+    mutProb = params['mutProb']
+
+    results = {}
+    for delay in delays:
+        shape = (numTrials, delay + numTimeStepsAfterDrug)
+        results[delay] = (numpy.zeros(shape=shape), numpy.zeros(shape=shape))
+
+    # Groups of rows simulated by one patient: every trial on its own, or
+    # blocks of BATCHED_BLOCK_TRIALS trials for the batched engine (as in
+    # iterateTrajectories)
+    makeGenerator = particleGenerator if engine == 'particle' else numpyGenerator
+    if engine == 'batched':
+        from virussim.batched import batchedPatients
+        groups = [(slice(start, min(start + BATCHED_BLOCK_TRIALS, numTrials)), firstTrial + start, \
+            batchedPatients(min(BATCHED_BLOCK_TRIALS, numTrials - start), numViruses, maxBirthProb, clearProb, \
+            resistances, mutProb, maxPop, makeGenerator(seed, firstTrial + start))) \
+            for start in range(0, numTrials, BATCHED_BLOCK_TRIALS)]
+    else:
+        groups = [(slice(trial, trial + 1), firstTrial + trial, resistantPatient(engine, numViruses, \
+            maxBirthProb, clearProb, resistances, mutProb, maxPop, makeGenerator(seed, firstTrial + trial))) \
+            for trial in range(numTrials)]
+
+    for rows, trialNumber, randPatientX in groups:
+        # Drug-free history, column t holds the population after t updates
+        prefixTotal = [randPatientX.getTotalPop()]
+        prefixResistant = [randPatientX.getResistPop([drug])]
+
+        for delay in sorted(delays):
+            firstColumn = max(delay, 1)
+            while len(prefixTotal) < firstColumn:
+                prefixTotal.append(randPatientX.update())
+                prefixResistant.append(randPatientX.getResistPop([drug]))
+
+            dataMatrixTotal, dataMatrixDrugResistant = results[delay]
+            for column in range(firstColumn):
+                dataMatrixTotal[rows, column] = prefixTotal[column]
+                dataMatrixDrugResistant[rows, column] = prefixResistant[column]
+
+            # Branch off and treat from time step delay on
+            branch = randPatientX.fork(makeGenerator(seed, trialNumber, delay))
+            branch.addPrescription(drug)
+            for column in range(firstColumn, delay + numTimeStepsAfterDrug):
+                dataMatrixTotal[rows, column] = branch.update()
+                dataMatrixDrugResistant[rows, column] = branch.getResistPop([drug])
+
+    return results